@@ -125,14 +125,25 @@
 
 # app.py
 import os
-from io import BytesIO
+import uuid
 
-import requests
 import numpy as np
 import pydeck as pdk
 import streamlit as st
 from PIL import Image
 
+from utils import http_client, metrics
+from utils.constants import TILE_OVERLAP, API_ENDPOINT_GET
+from utils.health import MONITOR
+from utils.image_store import ImageStore
+from utils.mapbox import fetch_static_view
+from utils.models import MODELS
+from utils.raster import MASK_SUFFIX, discard_upload, is_tiff, open_upload, spool_upload
+from utils.segmentation import segment, segment_models, segment_images, APIError
+from utils.tiling import axis_offsets, segment_tiled
+from utils.panels import render_sidebar_panels
+from utils.preprocessing import prescale, restore
+
 # -------------------- CONFIG --------------------
 
 st.set_page_config(
@@ -142,29 +153,37 @@ st.set_page_config(
 
 st.title("🌍 Satellite Segmentation Demo")
 
-# -------------------- API endpoints for each mode --------------------
-API_ENDPOINT_MODEL_1 = os.getenv("API_ENDPOINT_MODEL_1", "http://localhost:8000/upload-and-process")
-API_ENDPOINT_MODEL_2 = os.getenv("API_ENDPOINT_MODEL_2", "http://localhost:8000/upload-and-process")
-API_ENDPOINT_COMPARE = os.getenv("API_ENDPOINT_COMPARE", "http://localhost:8000/upload-and-process")
-API_ENDPOINT_EVOLUTION = os.getenv("API_ENDPOINT_EVOLUTION", "http://localhost:8000/upload-and-process")
+# -------------------- Models of each mode (see utils/models.py) --------------------
+MODE_MODELS = {
+    "U-net": "unet",
+    "U-net +": "unet_plus",
+    "Compare models": "compare",
+    "Surface evolution": "evolution",
+}
 
-# test endpoint
-API_ENDPOINT_GET = os.getenv("API_ENDPOINT_GET", "http://localhost:8000/")
+# Models available in "Compare models" (add an entry to compare one more)
+COMPARE_MODELS = {
+    "Model 1": "compare",
+    "Model 2": "unet_plus",
+}
 
 # -------------------- SIDEBAR MODE SELECTION --------------------
 st.sidebar.title("⚙️ Mode")
 mode = st.sidebar.radio(
     "our models:",
-    ("U-net", "U-net +", "Compare models", "Surface evolution")
+    tuple(MODE_MODELS)
 )
-if mode == "U-net":
-    API_ENDPOINT = API_ENDPOINT_MODEL_1
-elif mode == "U-net +":
-    API_ENDPOINT = API_ENDPOINT_MODEL_2
+MODEL = MODELS[MODE_MODELS[mode]]
+API_ENDPOINT = MODEL.endpoint
+
+# Wake up the models of this mode while the user picks an image (Cloud Run cold start)
+if mode == "Compare models":
+    MONITOR.watch(*COMPARE_MODELS.values())
 elif mode == "Surface evolution":
-    API_ENDPOINT = API_ENDPOINT_EVOLUTION
+    MONITOR.watch(MODE_MODELS[mode])
 else:
-    API_ENDPOINT = API_ENDPOINT_COMPARE
+    # The snapshot tab sends its image to U-net whatever the mode
+    MONITOR.watch(MODE_MODELS[mode], "unet")
 
 # Show which mode is active (optional)
 # st.info(f"Current mode: **{mode}**")
@@ -188,8 +207,14 @@ if MAPBOX_TOKEN:
 
 # -------------------- SESSION STATE --------------------
 
-if "captured_image" not in st.session_state:
-    st.session_state.captured_image = None
+if "captured_stored" not in st.session_state:
+    st.session_state.captured_stored = None  # StoredImage of the selected snapshot
+if "image_store" not in st.session_state:
+    st.session_state.image_store = ImageStore()  # session images, within a memory budget
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # groups this session's timings
+if "raster_upload" not in st.session_state:
+    st.session_state.raster_upload = None  # (file id, reader, thumbnail) of the uploaded TIFF
 
 if mode == "Compare models":
     st.subheader("🔍 Compare models on the same image")
@@ -202,50 +227,48 @@ if mode == "Compare models":
 
     if uploaded_file is not None:
         # Read image once
-        input_image = Image.open(uploaded_file).convert("RGB")
+        input_stored = st.session_state.image_store.add_upload(uploaded_file)
+        input_image = input_stored.image
 
         # Show input image
         st.markdown("### ✅ Input image")
         st.image(input_image, use_container_width=True)
 
-        if st.button("🚀 Run comparison"):
-            # Prepare file buffer
-            buf = BytesIO()
-            input_image.save(buf, format="PNG")
-            buf.seek(0)
-            files = {"file": ("input.png", buf.read(), "image/png")}
-
-            with st.spinner("Running both models..."):
-                # Call model 1
-                resp1 = requests.post(API_ENDPOINT, files=files)
-
-                # Rewind buffer for second call
-                buf.seek(0)
-                files = {"file": ("input.png", buf.read(), "image/png")}
-
-                # Call model 2
-                resp2 = requests.post(API_ENDPOINT_MODEL_2, files=files)
-
-            if resp1.status_code == 200 and resp2.status_code == 200:
-                pred1 = Image.open(BytesIO(resp1.content))
-                pred2 = Image.open(BytesIO(resp2.content))
+        selected = st.multiselect(
+            "Models to compare",
+            options=list(COMPARE_MODELS),
+            default=list(COMPARE_MODELS),
+            key="compare_models",
+        )
 
-                st.markdown("### 📊 Results")
+        if st.button("🚀 Run comparison") and selected:
+            st.markdown("### 📊 Results")
 
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.caption("🛰️ Original")
-                    st.image(input_image, use_container_width=True)
+            cols = st.columns(len(selected) + 1)
+            with cols[0]:
+                st.caption("🛰️ Original")
+                st.image(input_image, use_container_width=True)
 
-                with col2:
-                    st.caption("🧠 Model 1")
-                    st.image(pred1, use_container_width=True)
+            # One placeholder per model, filled as soon as its answer arrives
+            slots = {}
+            for col, name in zip(cols[1:], selected):
+                with col:
+                    slots[name] = st.empty()
+                    slots[name].info(f"⏳ {name}...")
 
-                with col3:
-                    st.caption("🧠 Model 2")
-                    st.image(pred2, use_container_width=True)
-            else:
-                st.error("One of the model calls failed. Check the API endpoints and logs.")
+            endpoints = {
+                name: (MODELS[COMPARE_MODELS[name]].endpoint, MODELS[COMPARE_MODELS[name]].class_data)
+                for name in selected
+            }
+            with metrics.trace("compare", owner=st.session_state.session_id):
+                for name, pred, seconds, error in segment_models(input_image, endpoints, original=input_stored.data):
+                    with slots[name].container(), metrics.stage("render"):
+                        if error is None:
+                            st.caption(f"🧠 {name} — {seconds:.2f} s")
+                            st.image(pred, use_container_width=True)
+                        else:
+                            st.error(f"{name} failed. Check the API endpoints and logs.")
+                            st.text(str(error)[:500])
 
 elif mode == "Surface evolution":
 
@@ -265,11 +288,11 @@ elif mode == "Surface evolution":
     #         st.session_state.captured_image = image
     #         st.success("Uploaded image selected for API ✅")
 
-    st.subheader("Upload 2 or 3 satellite images of the same place (different years)")
+    st.subheader("Upload satellite images of the same place (different years)")
 
     # Allow multiple files
     uploaded_files = st.file_uploader(
-        "Upload 2 or 3 satellite images (same location, different years)",
+        "Upload 2 or more satellite images (same location, different years)",
         type=["png", "jpg", "jpeg", "tif", "tiff"],
         accept_multiple_files=True,
         key="surface_evolution_uploader",
@@ -282,50 +305,34 @@ elif mode == "Surface evolution":
             st.warning("Please upload **at least 2 images**.")
             st.stop()
 
-        if n_files > 3:
-            st.warning("Please upload **maximum 3 images**.")
-            st.stop()
-        else:
-            # Open input images
-            images = [Image.open(f).convert("RGB") for f in uploaded_files]
-
-            st.markdown("### ✅ Input images")
-            cols = st.columns(3)
-            for i, (col, img, f) in enumerate(zip(cols, images, uploaded_files), start=1):
-                with col:
-                    st.image(img, caption=f"Image {i}: {f.name}", use_container_width=True)
-
-            if st.button("🚀 Run model on 3 images", key="run_surface_evolution"):
-                predictions = []
-
-                with st.spinner("Running the model on all images..."):
-                    for img in images:
-                        # Prepare buffer for API
-                        buf = BytesIO()
-                        img.save(buf, format="PNG")
-                        buf.seek(0)
-
-                        files = {"file": ("input.png", buf.read(), "image/png")}
-
-                        # 🔴 IMPORTANT: API_ENDPOINT should be the endpoint of the ONE model you want
-                        # e.g. API_ENDPOINT_MODEL_1 or whatever you chose earlier
-                        resp = requests.post(API_ENDPOINT, files=files)
-
-                        if resp.status_code == 200:
-                            pred_img = Image.open(BytesIO(resp.content))
-                            predictions.append(pred_img)
+        # Decode each date once: reruns reuse the images already opened
+        store = st.session_state.image_store
+        images = [stored.image for stored in store.add_uploads(uploaded_files)]
+        n_cols = min(n_files, 3)
+
+        st.markdown("### ✅ Input images")
+        cols = st.columns(n_cols)
+        for i, (img, f) in enumerate(zip(images, uploaded_files)):
+            with cols[i % n_cols]:
+                st.image(img, caption=f"Image {i + 1}: {f.name}", use_container_width=True)
+
+        if st.button(f"🚀 Run model on {n_files} images", key="run_surface_evolution"):
+            st.markdown("### 🧠 Model outputs (aligned horizontally)")
+            out_cols = st.columns(n_cols)
+            slots = []
+            for i in range(n_files):
+                with out_cols[i % n_cols]:
+                    slots.append(st.empty())
+                    slots[i].info(f"⏳ Prediction {i + 1}...")
+
+            # Dates run in parallel; already-seen dates come straight from the cache
+            with metrics.trace("evolution", API_ENDPOINT, st.session_state.session_id):
+                for i, pred, seconds, error in segment_images(images, API_ENDPOINT, class_data=MODEL.class_data):
+                    with slots[i].container(), metrics.stage("render"):
+                        if error is None:
+                            st.image(pred, caption=f"Prediction {i + 1} ({seconds:.2f} s)", use_container_width=True)
                         else:
-                            st.error(f"API call failed with status code {resp.status_code}")
-                            predictions = []
-                            break
-
-                if predictions:
-                    st.markdown("### 🧠 Model outputs (aligned horizontally)")
-                    out_cols = st.columns(3)
-                    for i, (col, pred) in enumerate(zip(out_cols, predictions), start=1):
-                        with col:
-                            st.image(pred, caption=f"Prediction {i}", use_container_width=True)
-
+                            st.error(f"API call failed for image {i + 1}: {str(error)[:500]}")
 
 else:
     # -------------------- TABS --------------------
@@ -354,20 +361,99 @@ else:
             key="file_uploader",
         )
 
+        # A replaced (or removed) TIFF: close its reader, delete its spooled files
+        raster_upload = st.session_state.raster_upload
+        if raster_upload is not None and (uploaded_file is None or uploaded_file.file_id != raster_upload[0]):
+            raster_upload[1].close()
+            discard_upload(raster_upload[1].path)
+            st.session_state.raster_upload = raster_upload = None
+
         if uploaded_file is not None:
-            image = Image.open(uploaded_file).convert("RGB")
-            display_image = image.copy()
-            display_image.thumbnail((DISPLAY_WIDTH, DISPLAY_WIDTH))
+            raster_path = None
+            if is_tiff(uploaded_file.name):
+                # Orthophotos: spooled to disk and read window by window, never decoded whole.
+                # Opened once per upload, not on every rerun
+                if raster_upload is None:
+                    reader = open_upload(spool_upload(uploaded_file))
+                    raster_upload = (uploaded_file.file_id, reader, reader.thumbnail(DISPLAY_WIDTH))
+                    st.session_state.raster_upload = raster_upload
+                _, image, display_image = raster_upload
+                raster_path = image.path
+            else:
+                image = st.session_state.image_store.add_upload(uploaded_file).image
+                display_image = image.copy()
+                display_image.thumbnail((DISPLAY_WIDTH, DISPLAY_WIDTH))
             st.image(display_image, caption="Uploaded image", use_container_width=False)
 
-            img_array = np.array(image)
-            st.write("Image shape:", img_array.shape)
-            x_chunks = round(img_array.shape[1]/256)
-            y_chunks = round(img_array.shape[0]/256)
+            width, height = image.size
+            st.write("Image shape:", (height, width, 3))
+
+            # Photos are resampled on the client to the model's ground resolution: fewer tiles to send.
+            # Rasters are read window by window, so they are tiled at full resolution
+            prescaled = None
+            if raster_path is None and st.checkbox(
+                "⚡ Pre-scale to the model's ground resolution", value=False, key="prescale"
+            ):
+                ground_resolution = st.number_input(
+                    "Ground resolution of the image (m / pixel, 0 if unknown)",
+                    min_value=0.0, value=0.0, step=0.05, key="ground_resolution",
+                )
+                if ground_resolution:
+                    prescaled = prescale(image, MODEL, ground_resolution)
+                    st.write("Pre-scaled shape:", (prescaled.image.height, prescaled.image.width, 3))
+                else:
+                    st.caption("Pre-scaling needs the ground resolution: until then the image is sent as is.")
+            tiled_image = prescaled.image if prescaled is not None else image
+
+            overlap = st.slider(
+                "Tile overlap (pixels)", min_value=0, max_value=MODEL.input_size // 2,
+                value=TILE_OVERLAP, step=16, key="tile_overlap",
+            )
+            tiled_width, tiled_height = tiled_image.size
+            x_chunks = len(axis_offsets(tiled_width, MODEL.input_size, overlap))
+            y_chunks = len(axis_offsets(tiled_height, MODEL.input_size, overlap))
             total_chunks = x_chunks * y_chunks
             st.write(y_chunks," divisions sur la hauteur de l'image et",x_chunks, "sur la largeur")
             st.write("Nombre de chunks:", total_chunks)
 
+            if st.button("🧩 Run tiled segmentation", key="run_tiled"):
+                progress_bar = st.progress(0.0, text=f"0 / {total_chunks} tiles")
+
+                def show_progress(done, total):
+                    progress_bar.progress(done / total, text=f"{done} / {total} tiles")
+
+                # Raster masks are stitched into a disk-backed array, not in RAM
+                out = None
+                if raster_path is not None:
+                    out = np.lib.format.open_memmap(
+                        f"{raster_path}{MASK_SUFFIX}", mode="w+", dtype=np.uint8, shape=(height, width, 3)
+                    )
+
+                with metrics.trace("tiled", API_ENDPOINT, st.session_state.session_id):
+                    try:
+                        mask = segment_tiled(
+                            tiled_image, API_ENDPOINT, MODEL.input_size, overlap,
+                            class_data=MODEL.class_data, progress=show_progress, out=out,
+                        )
+                        if prescaled is not None:
+                            mask = restore(mask, prescaled)
+                    except APIError as e:
+                        st.error(f"API request failed (status {e.status_code}). Please try again.")
+                        st.text(f"Response text: {e.text[:500]}")
+                    except http_client.RequestException as e:
+                        st.error("API request failed due to an exception.")
+                        st.text(str(e))
+                    else:
+                        with metrics.stage("render"):
+                            if out is not None:
+                                step = max(1, -(-max(width, height) // DISPLAY_WIDTH))
+                                display_mask = Image.fromarray(np.ascontiguousarray(mask[::step, ::step]))
+                            else:
+                                display_mask = mask.copy()
+                                display_mask.thumbnail((DISPLAY_WIDTH, DISPLAY_WIDTH), Image.NEAREST)
+                            st.markdown("### 🎨 Full-resolution mask")
+                            st.image(display_mask, caption=f"Stitched mask {width}x{height}", use_container_width=False)
+
             # if st.button("➡️ Use this image for the API", key="use_uploaded"):
             #     st.session_state.captured_image = image
             #     st.success("Uploaded image selected for API ✅")
@@ -416,59 +502,49 @@ else:
             if st.button("📸 Take snapshot", key="take_snapshot"):
                 width = height = snapshot_size
 
-                # Mapbox Static Images API URL
-                url = (
-                    f"https://api.mapbox.com/styles/v1/mapbox/satellite-v9/static/"
-                    f"{lon},{lat},{zoom},0,0/{width}x{height}"
-                    f"?access_token={MAPBOX_TOKEN}"
-                )
-
-                with st.spinner("Fetching snapshot from Mapbox..."):
-                    resp = requests.get(url)
-
-                if resp.status_code != 200:
-                    st.error(f"Error getting snapshot from Mapbox (status {resp.status_code}).")
+                try:
+                    with st.spinner("Fetching snapshot from Mapbox..."), metrics.trace("capture", owner=st.session_state.session_id):
+                        snap_image = fetch_static_view(
+                            lon, lat, zoom, MAPBOX_TOKEN, width, height, style="mapbox/satellite-v9"
+                        )
+                except http_client.RequestException as e:
+                    st.error(f"Error getting snapshot from Mapbox ({e}).")
                 else:
-                    img_bytes = BytesIO(resp.content)
-                    snap_image = Image.open(img_bytes).convert("RGB")
-
                     st.image(
                         snap_image,
                         caption=f"Snapshot @ lat={lat}, lon={lon}, zoom={zoom}",
                         use_container_width=False,
                     )
 
-                    snap_array = np.array(snap_image)
-                    st.write("Snapshot shape:", snap_array.shape)
+                    st.write("Snapshot shape:", (snap_image.height, snap_image.width, 3))
 
                     if st.button("➡️ Use this snapshot for the API", key="use_snapshot"):
-                        st.session_state.captured_image = snap_image
+                        st.session_state.captured_stored = st.session_state.image_store.add_image(
+                            f"snapshot:{lon}:{lat}:{zoom}:{snapshot_size}", snap_image, "snapshot"
+                        )
                         st.success("Snapshot selected for API ✅")
 
 
     # -------------------- API CALL SECTION --------------------
 
-    if st.session_state.captured_image is not None:
+    if st.session_state.captured_stored is not None:
         if st.button("🚀 Send to API", type="primary", key="send_to_api"):
-            buffer = BytesIO()
-            st.session_state.captured_image.save(buffer, format="PNG")
-            buffer.seek(0)
-
-            files = {"file": ("input.png", buffer.read(), "image/png")}
-
             try:
-                with st.spinner("Processing image..."):
-                    response = requests.post(API_ENDPOINT_MODEL_1, files=files)
-
-                if response.status_code == 200:
-                    output_image = Image.open(BytesIO(response.content))
-
-                    st.markdown("### 🎨 Output image")
-                    st.image(output_image, use_container_width=True)
-                    st.success("Image successfully processed ✨")
-                else:
-                    st.error(f"API request failed (status {response.status_code}). Please try again.")
-                    st.text(f"Response text: {response.text[:500]}")
+                with metrics.trace("predict", MODELS["unet"].endpoint, st.session_state.session_id):
+                    with st.spinner("Processing image..."):
+                        output_image = segment(
+                            st.session_state.captured_stored.image, MODELS["unet"].endpoint,
+                            class_data=MODELS["unet"].class_data,
+                        )
+
+                    with metrics.stage("render"):
+                        st.markdown("### 🎨 Output image")
+                        st.image(output_image, use_container_width=True)
+                        st.success("Image successfully processed ✨")
+
+            except APIError as e:
+                st.error(f"API request failed (status {e.status_code}). Please try again.")
+                st.text(f"Response text: {e.text[:500]}")
 
             except Exception as e:
                 st.error("API request failed due to an exception.")
@@ -481,10 +557,14 @@ else:
     st.markdown("---")
     if st.button("🤗 Test API", key="test_api"):
         try:
-            response = requests.get(API_ENDPOINT_GET, timeout=5)
+            response = http_client.get(API_ENDPOINT_GET, timeout=5)
             response.raise_for_status()
             greeting = response.json().get("greeting", str(response.json()))
             st.markdown(greeting)
         except Exception as e:
             st.markdown("Something went wrong 😥")
             st.text(str(e))
+
+# -------------------- SIDEBAR PANELS --------------------
+
+render_sidebar_panels(memory=False)
@@ -1,17 +1,26 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-import requests
-from io import BytesIO
-from PIL import Image
-import numpy as np
 # Import constants and dictionaries
-from utils.constants import MAPBOX_STYLE, INITIAL_CENTER, INITIAL_ZOOM, API_ENDPOINT_INITIAL, FLAIR_CLASS_DATA
+from utils.constants import MAPBOX_STYLE, INITIAL_CENTER, INITIAL_ZOOM
+from utils.segmentation import segment, APIError
+from utils.image_store import ImageStore
+from utils.models import MODELS
+from utils.health import MONITOR
+from utils.preprocessing import prescale, restore
+from utils import http_client
+from utils.mapbox import bbox_from_bounds, bbox_string, fetch_static_bbox
+from utils.panels import render_sidebar_panels
 
 # -------------------- CONFIG --------------------------------------------------
 st.header("🛰️ Exploration - Initial model")
 
-DICO_LABEL = FLAIR_CLASS_DATA
+MODEL_KEY = "initial"
+MODEL = MODELS[MODEL_KEY]
+DICO_LABEL = MODEL.class_data
+
+# Wake the model up while the user picks an image (Cloud Run cold start)
+MONITOR.watch(MODEL_KEY)
 # -------------------- STYLES --------------------------------------------------
 
 st.markdown(
@@ -61,12 +70,14 @@ st.markdown(
 # --- Initialize session state variables for management ------------------------
 if "image_source" not in st.session_state:
     st.session_state.image_source = None  # 'upload' or 'map'
-if "uploaded_file_object" not in st.session_state:
-    st.session_state.uploaded_file_object = None
-if "captured_image" not in st.session_state:
-    st.session_state.captured_image = None
+if "uploaded_file_id" not in st.session_state:
+    st.session_state.uploaded_file_id = None  # only the id: the image store holds the bytes
 if "last_bbox" not in st.session_state:
     st.session_state.last_bbox = None
+if "image_store" not in st.session_state:
+    st.session_state.image_store = ImageStore()  # session images, within a memory budget
+if "captured_stored" not in st.session_state:
+    st.session_state.captured_stored = None  # StoredImage of the current input (upload or capture)
 
 tab_upload, tab_map = st.tabs(["📂 Upload an image", "🗺️ Explore the world"])
 with tab_upload:
@@ -78,20 +89,24 @@ with tab_upload:
         key="file_uploader_key"
     )
 
-    if uploaded and uploaded != st.session_state.uploaded_file_object:
-        # Check if the image currently stored is from the map tab
-        if st.session_state.image_source == 'map':
-            st.session_state.captured_image = None # Clear map image
-
-        # Process the new uploaded image
-        image = Image.open(uploaded).convert("RGB")
-        st.session_state.captured_image = image
+    if uploaded and uploaded.file_id != st.session_state.uploaded_file_id:
+        # Process the new uploaded image (kept encoded, replaces any map capture)
+        stored = st.session_state.image_store.add_upload(uploaded)
+        st.session_state.captured_stored = stored
         st.session_state.image_source = 'upload' # Set source flag
-        st.session_state.uploaded_file_object = uploaded # Store the file object reference
+        st.session_state.uploaded_file_id = uploaded.file_id # Store the upload id
 
         # Display image shape
-        img_array = np.array(image)
-        st.write(f'Image shape: {img_array.shape}')
+        st.write(f'Image shape: {stored.shape}')
+
+    # Large photos are resampled on the client to the model's ground resolution instead of being shipped full size
+    st.checkbox("⚡ Pre-scale to the model's ground resolution", value=False, key="prescale")
+    st.number_input(
+        "Ground resolution of the image (m / pixel, 0 if unknown)",
+        min_value=0.0, value=0.0, step=0.05, key="ground_resolution",
+    )
+    if st.session_state.prescale and not st.session_state.ground_resolution:
+        st.caption("Pre-scaling needs the ground resolution: until then the image is sent as is.")
 
 with tab_map:
     st.info(
@@ -115,71 +130,82 @@ with tab_map:
         if map_data and 'bounds' in map_data:
             # Check if the image currently stored is from the upload tab
             if st.session_state.image_source == 'upload':
-                st.session_state.captured_image = None # Clear uploaded image
+                st.session_state.captured_stored = None # Clear uploaded image
 
             # The 'bounds' dictionary contains the NorthEast (NE) and SouthWest (SW) corners
             # of the current map view (bounding box - bbox).
-            sw_lat = map_data['bounds']['_southWest']['lat']
-            sw_lon = map_data['bounds']['_southWest']['lng']
-            ne_lat = map_data['bounds']['_northEast']['lat']
-            ne_lon = map_data['bounds']['_northEast']['lng']
-            bbox_string = f"{sw_lon},{sw_lat},{ne_lon},{ne_lat}"
-            st.session_state.last_bbox = bbox_string
-
-            # --- Static Images API Call ---
+            bbox = bbox_from_bounds(map_data['bounds'])
+            st.session_state.last_bbox = bbox_string(bbox)
+
+            # --- Static Images API Call (cached on style, bbox, size and padding) ---
             image_width = 512
             image_height = 512
-            static_api_url = f"https://api.mapbox.com/styles/v1/{MAPBOX_STYLE}/static/[{bbox_string}]/{image_width}x{image_height}?access_token={MAPBOX_TOKEN}&padding=0.1"
 
             with st.spinner("Fetching static map image..."):
                 try:
-                    response = requests.get(static_api_url)
-                    response.raise_for_status()
-
-                    image = Image.open(BytesIO(response.content)).convert("RGB")
-                    st.session_state.captured_image = image
+                    image = fetch_static_bbox(bbox, MAPBOX_TOKEN, image_width, image_height, padding=0.1)
+                    st.session_state.captured_stored = st.session_state.image_store.add_image(
+                        f"map:{st.session_state.last_bbox}", image, "map capture"
+                    )
                     st.session_state.image_source = 'map' # Set source flag
 
                     st.success("✅ Map view captured!")
 
                     # Display image shape
-                    img_array = np.array(image)
-                    st.write(f'Image shape: {img_array.shape}')
-                except requests.exceptions.RequestException as e:
+                    st.write(f'Image shape: {(image.height, image.width, 3)}')
+                except http_client.RequestException as e:
                     st.error(f"Error fetching image from Mapbox API: {e}")
-                    st.session_state.captured_image = None
+                    st.session_state.captured_stored = None
         else:
             st.warning("Please interact with the map first to set the view.")
 
 # -------------------- API CALL ------------------------------------------------
 
-if st.session_state.captured_image:
+stored = st.session_state.captured_stored
+if stored:
+    captured_image = stored.image  # decoded again if the store released it
     st.markdown("### ✅ Input image")
     # Display the captured image, this replaces the previous uploaded file display
-    st.image(st.session_state.captured_image, use_container_width=False)
+    st.image(captured_image, use_container_width=False)
 
     if st.button("🚀 Send to API"):
-        # Existing API logic
-        buffer = BytesIO()
-        st.session_state.captured_image.save(buffer, format="PNG")
-        buffer.seek(0)
-
-        files = {"file": ("input.png", buffer.read(), "image/png")}
-
+        # Cached on the image content + endpoint: repeat clicks skip the API
+        output_image, api_error = None, None
         with st.spinner("Processing image..."):
-            response = requests.post(API_ENDPOINT_INITIAL, files=files)
-
-        if response.status_code == 200:
-            output_image = Image.open(BytesIO(response.content))
-
+            try:
+                if st.session_state.image_source == 'upload' and st.session_state.get("prescale") and st.session_state.get("ground_resolution"):
+                    # Send the image at the model's resolution, map the mask back to full size
+                    prescaled = prescale(stored.image, MODEL, st.session_state.ground_resolution)
+                    output_image = restore(
+                        segment(prescaled.image, MODEL.endpoint, class_data=DICO_LABEL), prescaled
+                    )
+                else:
+                    # Inputs go out as their stored file, without re-encoding
+                    output_image = segment(
+                        captured_image, MODEL.endpoint, class_data=DICO_LABEL,
+                        digest=stored.pixel_digest,
+                        original=stored.data,
+                    )
+            except (APIError, http_client.RequestException) as e:
+                api_error = e
+
+        if output_image is not None:
             st.markdown("### 🖼️ Result")
             st.success("✅ Image successfully processed")
+            upload = output_image.info.get("upload", {})
+            if upload:
+                st.caption(
+                    f"Sent {upload['bytes'] / 1024:.0f} KB ({upload['encoder']}, "
+                    f"encoded in {upload['seconds'] * 1000:.0f} ms)"
+                )
+            elif upload is None:
+                st.caption("⚡ Served from the prediction cache")
 
             col1, col2, col3 = st.columns([2, 2, 1])
 
             with col1:
                 st.caption("Input image")
-                st.image(st.session_state.captured_image, use_container_width=False)
+                st.image(captured_image, use_container_width=False)
 
             with col2:
                 st.caption("Predicted label")
@@ -214,4 +240,9 @@ if st.session_state.captured_image:
                         st.warning("DICO_LABEL is not defined to display the legend.")
 
         else:
-            st.error(f"API error ({response.status_code}): {response.text}")
+            st.error(str(api_error))
+
+
+# -------------------- SIDEBAR PANELS ------------------------------------------
+
+render_sidebar_panels(latency=False, models=False)
@@ -0,0 +1,68 @@
+"""Segment a directory (or a manifest) of images without the Streamlit pages.
+
+    python batch_segment.py imagery/ --model latest --out runs/june --workers 8
+
+Masks are written to ``<out>/masks/<id>.png`` as palette PNGs (pixel values
+are class ids; ``a.jpg`` gives ``a.jpg.png``) and every image gets a line in ``<out>/manifest.jsonl`` with its
+timings and class percentages. Re-running the same command resumes: images
+already in the manifest are skipped.
+"""
+import argparse
+import os
+import sys
+import time
+
+from utils.batch import find_images, read_manifest, run_batch
+from utils.constants import BATCH_WORKERS, BATCH_RETRIES, TILE_SIZE, TILE_OVERLAP
+from utils.models import MODELS
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory of images, or a manifest file (paths or JSONL)")
+    parser.add_argument("--out", required=True, help="output directory for masks and manifest")
+    parser.add_argument("--model", choices=sorted(MODELS), default="latest")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="images in flight at once")
+    parser.add_argument("--retries", type=int, default=BATCH_RETRIES, help="extra attempts on transient errors")
+    parser.add_argument(
+        "--tile-size", type=int, default=0,
+        help=f"segment images larger than this tile by tile (0: never; e.g. {TILE_SIZE})",
+    )
+    parser.add_argument("--overlap", type=int, default=TILE_OVERLAP, help="tile overlap in pixels")
+    parser.add_argument("--manifest", help="manifest / checkpoint path (default: <out>/manifest.jsonl)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    items = read_manifest(args.source) if os.path.isfile(args.source) else find_images(args.source)
+    model = MODELS[args.model]
+    print(f"{len(items)} images, model: {model.name}", file=sys.stderr)
+
+    start = time.perf_counter()
+    ok = failed = 0
+    try:
+        for record in run_batch(
+            items, model, args.out, args.manifest, max_workers=args.workers,
+            retries=args.retries, tile_size=args.tile_size, overlap=args.overlap,
+        ):
+            if record["status"] == "ok":
+                ok += 1
+            else:
+                failed += 1
+            line = f"[{ok + failed}] {record['id']}: {record['status']} in {record['seconds']:.2f} s"
+            if record["status"] != "ok":
+                line += f" ({record['error']})"
+            print(line, file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted: run the same command again to resume.", file=sys.stderr)
+        return 130
+
+    elapsed = time.perf_counter() - start
+    rate = ok / elapsed if elapsed else 0.0
+    print(f"Done: {ok} segmented, {failed} failed in {elapsed:.0f} s ({rate:.2f} images / s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Local stand-in for the segmentation backend, for benchmarks and offline work.
+
+    python -m benchmarks.mock_server --port 8000 --latency 0.3
+
+Answers ``POST /upload-and-process/`` (FLAIR classes) and
+``POST /upload-and-process-reduced/`` (REDUCED_7) with a mask the size of the
+uploaded image: a palette PNG of class ids when ``mask_format=index`` is
+asked for, a colorized RGB PNG otherwise, after ``latency`` seconds. Only
+the image header is read, so the server itself costs next to nothing.
+"""
+import argparse
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image
+
+from utils.constants import FLAIR_CLASS_DATA, REDUCED_7
+from utils.labels import colorize, palette
+
+ROUTES = {
+    "/upload-and-process/": FLAIR_CLASS_DATA,
+    "/upload-and-process-reduced/": REDUCED_7,
+}
+BLOCK = 64   # side of the class blocks drawn in the masks
+
+
+def multipart_file(body, content_type):
+    """Bytes of the first file part of a multipart/form-data body."""
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    for part in body.split(b"--" + boundary):
+        headers, sep, data = part.partition(b"\r\n\r\n")
+        if sep and b"filename=" in headers:
+            return data[:-2] if data.endswith(b"\r\n") else data
+    raise ValueError("no file in the request")
+
+
+def image_size(data):
+    """(width, height) of an uploaded PNG / JPEG / WEBP / .npy, from its header."""
+    if data.startswith(b"\x93NUMPY"):
+        height, width = np.load(BytesIO(data), allow_pickle=False).shape[:2]
+        return width, height
+    with Image.open(BytesIO(data)) as image:
+        return image.size
+
+
+@lru_cache(maxsize=16)
+def render_mask(width, height, mask_format, reduced):
+    """Encoded mask of blocks cycling through every class."""
+    class_data = REDUCED_7 if reduced else FLAIR_CLASS_DATA
+    y, x = np.ogrid[:height, :width]
+    index = ((y // BLOCK + x // BLOCK) % len(class_data)).astype(np.uint8)
+    if mask_format == "index":
+        mask = Image.fromarray(index, mode="L").convert("P")
+        mask.putpalette(palette(class_data).tobytes())
+    else:
+        mask = Image.fromarray(colorize(index, class_data))
+    buffer = BytesIO()
+    mask.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, like Cloud Run
+        disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+        def do_GET(self):
+            self._reply(200, b'{"status": "ok"}', "application/json")
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if url.path not in ROUTES:
+                self._reply(404, b"not found", "text/plain")
+                return
+            try:
+                width, height = image_size(multipart_file(body, self.headers["Content-Type"]))
+            except (ValueError, OSError, KeyError, IndexError) as e:
+                self._reply(400, str(e).encode(), "text/plain")
+                return
+            mask_format = parse_qs(url.query).get("mask_format", ["rgb"])[0]
+            mask = render_mask(width, height, mask_format, ROUTES[url.path] is REDUCED_7)
+            time.sleep(latency)
+            self._reply(200, mask, "image/png")
+
+        def _reply(self, status, content, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_server(latency=0.0, port=0):
+    """Serve in a background thread; returns the server and its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.latency))
+    print(f"Serving on http://127.0.0.1:{args.port} (latency {args.latency} s)")
+    server.serve_forever()
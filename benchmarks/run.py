@@ -0,0 +1,163 @@
+"""Time every stage of a prediction against the local mock backend.
+
+    python -m benchmarks.run --output bench_output.json --baseline benchmarks/baseline.json
+
+For each image size: decode the upload, encode the payload, upload it
+(round trip to the mock, ``--latency`` included), decode the mask answer,
+colorize it and compute class statistics. Results are written as JSON and,
+given a baseline, compared stage by stage; the exit status is 1 when a
+stage got slower than the tolerance allows.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from benchmarks.mock_server import start_server
+from utils import http_client
+from utils.constants import MASK_FORMAT, FLAIR_CLASS_DATA, REDUCED_7
+from utils.encoding import encode_image
+from utils.labels import class_percentages, colorize, decode_mask
+
+SIZES = [256, 512, 1024, 2048, 4096, 8192]
+STAGES = ["decode", "encode", "upload", "response_decode", "colorize", "stats"]
+NOISE_FLOOR = 0.002   # seconds: differences below this are never regressions
+
+
+def synthetic_image(size, seed=0):
+    """PNG bytes of a ``size`` x ``size`` image that compresses like imagery
+    (smooth gradients plus noise), not like pure noise or flat color."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 160, size, dtype=np.float32)
+    base = ramp[None, :, None] * 0.6 + ramp[:, None, None] * 0.4
+    pixels = base + rng.normal(0, 12, (size, size, 3)).astype(np.float32)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def timed(fn, repeat):
+    """Last result of ``fn()`` and the seconds each of ``repeat`` calls took."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def bench_size(size, endpoint, class_data, encoder, repeat):
+    data = synthetic_image(size)
+    results = {}
+
+    def record(stage, fn):
+        value, times = timed(fn, repeat)
+        results[stage] = {"median": statistics.median(times), "min": min(times)}
+        return value
+
+    image = record("decode", lambda: Image.open(BytesIO(data)).convert("RGB"))
+    payload = record("encode", lambda: encode_image(image, encoder=encoder))
+
+    def upload():
+        # Straight to the backend: the prediction cache would hide the round trip
+        files = {"file": (payload.filename, payload.data, payload.mime)}
+        response = http_client.post(endpoint, files=files, params={"mask_format": MASK_FORMAT}, idempotent=True)
+        response.raise_for_status()
+        return response.content
+
+    content = record("upload", upload)
+    index = record("response_decode", lambda: decode_mask(content, class_data))
+    record("colorize", lambda: colorize(index, class_data))
+    record("stats", lambda: class_percentages(index, class_data))
+    results["payload_bytes"] = len(payload.data)
+    results["mask_bytes"] = len(content)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing each stage against the baseline, and the regressions."""
+    lines, regressions = [], []
+    for size, stages in results["sizes"].items():
+        base_stages = baseline.get("sizes", {}).get(size)
+        if base_stages is None:
+            continue
+        for stage in STAGES:
+            now, before = stages[stage]["median"], base_stages.get(stage, {}).get("median")
+            if not before:
+                continue
+            ratio = now / before
+            slower = ratio > 1 + tolerance and now - before > NOISE_FLOOR
+            lines.append(
+                f"{size:>5}  {stage:<16} {before * 1000:10.1f} ms -> {now * 1000:10.1f} ms  "
+                f"x{ratio:5.2f}{'  REGRESSION' if slower else ''}"
+            )
+            if slower:
+                regressions.append((size, stage, ratio))
+    return lines, regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="image sides in pixels")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage (the median is kept)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock adds to every answer")
+    parser.add_argument("--reduced", action="store_true", help="use the REDUCED_7 endpoint")
+    parser.add_argument("--encoder", default="png-fast", help="payload encoder (see utils/encoding.py)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown ratio per stage")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server, base_url = start_server(args.latency)
+    route = "/upload-and-process-reduced/" if args.reduced else "/upload-and-process/"
+    class_data = REDUCED_7 if args.reduced else FLAIR_CLASS_DATA
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "latency": args.latency,
+            "encoder": args.encoder,
+            "mask_format": MASK_FORMAT,
+            "repeat": args.repeat,
+        },
+        "sizes": {},
+    }
+    try:
+        for size in args.sizes:
+            stages = bench_size(size, base_url + route, class_data, args.encoder, args.repeat)
+            results["sizes"][str(size)] = stages
+            timings = "  ".join(f"{stage} {stages[stage]['median'] * 1000:.1f}" for stage in STAGES)
+            print(f"{size:>5}²  {timings} (ms)", file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance)
+        print("\n".join(lines), file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than the baseline", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
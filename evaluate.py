@@ -0,0 +1,85 @@
+"""Score the registered models against ground-truth masks (per-class and mean IoU).
+
+    python evaluate.py data/eval --model initial --model latest --out runs/iou.json
+
+The source is a folder of image / mask pairs (``images/`` + ``masks/``, or
+``<name>_mask.png`` next to ``<name>.png``), or a single image with
+``--mask``. Ground truth is given in the FLAIR classes unless
+``--truth-classes reduced``; it is mapped onto REDUCED_7 for the models
+using it. Reports are cached per dataset content hash and model.
+"""
+import argparse
+import json
+import os
+import sys
+
+from utils.constants import EVAL_WORKERS, FLAIR_CLASS_DATA, REDUCED_7, TILE_SIZE, TILE_OVERLAP
+from utils.evaluation import EvalPair, evaluate_models, find_pairs
+from utils.models import EVAL_MODELS, MODELS
+
+TRUTH_CLASSES = {"flair": FLAIR_CLASS_DATA, "reduced": REDUCED_7}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory of image / mask pairs, or one image (with --mask)")
+    parser.add_argument("--mask", help="ground-truth mask of a single source image")
+    parser.add_argument(
+        "--model", choices=sorted(MODELS), action="append",
+        help=f"model to score (repeatable; default: {', '.join(EVAL_MODELS)})",
+    )
+    parser.add_argument("--truth-classes", choices=sorted(TRUTH_CLASSES), default="flair")
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS, help="images in flight at once")
+    parser.add_argument(
+        "--tile-size", type=int, default=0,
+        help=f"segment images larger than this tile by tile (0: never; e.g. {TILE_SIZE})",
+    )
+    parser.add_argument("--overlap", type=int, default=TILE_OVERLAP, help="tile overlap in pixels")
+    parser.add_argument("--out", help="write the reports (JSON) to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mask:
+        pairs = [EvalPair(os.path.basename(args.source), args.source, args.mask)]
+    else:
+        pairs = find_pairs(args.source)
+    if not pairs:
+        print(f"No image / mask pairs found in {args.source}", file=sys.stderr)
+        return 2
+    print(f"{len(pairs)} images", file=sys.stderr)
+
+    def show_progress(done, total):
+        print(f"\r  {done} / {total}", end="", file=sys.stderr)
+
+    reports = {}
+    try:
+        for key, report in evaluate_models(
+            pairs, args.model, truth_class_data=TRUTH_CLASSES[args.truth_classes],
+            max_workers=args.workers, progress=show_progress,
+            tile_size=args.tile_size, overlap=args.overlap,
+        ):
+            reports[key] = report
+            print(file=sys.stderr)
+            mean_iou = "n/a" if report["mean_iou"] is None else f"{report['mean_iou']:.3f}"
+            print(f"{report['model']}: mean IoU {mean_iou} over {report['images']} images", end="")
+            print(f" ({len(report['failed'])} failed)" if report["failed"] else "")
+            for name, iou in report["classes"].items():
+                if iou is not None:
+                    print(f"  {name:<24} {iou:.3f}")
+            for failure in report["failed"]:
+                print(f"  ! {failure['id']}: {failure['error']}", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("\nInterrupted.", file=sys.stderr)
+        return 130
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 1 if any(report["failed"] for report in reports.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,45 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-import requests
-from io import BytesIO
-from PIL import Image
-import numpy as np
+import time
+import uuid
 # Import constants and dictionaries
-from utils.constants import MAPBOX_STYLE, INITIAL_CENTER, INITIAL_ZOOM, API_ENDPOINT_LATEST, REDUCED_7
+from utils.constants import MAPBOX_STYLE, INITIAL_CENTER, INITIAL_ZOOM, FLAIR_CLASS_DATA, SPECULATIVE_MAX_JOBS
+from utils.segmentation import segment
+from utils.image_store import ImageStore
+from utils.jobs import JOBS
+from utils.evaluation import evaluation_job
+from utils.labels import class_names
+from utils.agreement import compare_models
+from utils.models import MODELS
+from utils.health import MONITOR, READY, DOWN
+from utils.preprocessing import prescale, restore
+from utils import http_client, metrics
+from utils.mapbox import bbox_from_bounds, bbox_string, fetch_static_bbox, static_bbox_bounds
+from utils.panels import export_panel, iou_panel, job_status, render_sidebar_panels
 
 # -------------------- CONFIG --------------------------------------------------
 st.header("🎯 Fine-tuning the model")
 
-DICO_LABEL = REDUCED_7
+MODEL_KEY = "latest"
+MODEL = MODELS[MODEL_KEY]
+DICO_LABEL = MODEL.class_data
+
+# Wake the model up while the user picks an image (Cloud Run cold start)
+MONITOR.watch(MODEL_KEY)
 
 # --- START AMENDMENT: Cross-Page Data Initialization ---
 
 # Check if an uploaded file object exists from a previous session/page
-if st.session_state.uploaded_file_object is not None:
-    # 1. Rewind the file pointer to the beginning (in case it was read on the previous page)
-    st.session_state.uploaded_file_object.seek(0)
-
-    # 2. Re-open the file object to get the PIL Image
+if st.session_state.get("uploaded_file_id") is not None and "image_store" in st.session_state:
+    # Reuse the image stored on the previous page instead of re-opening the file
     try:
-        image = Image.open(st.session_state.uploaded_file_object).convert("RGB")
+        stored = st.session_state.image_store.get(st.session_state.uploaded_file_id)
+        if stored is None:
+            raise KeyError("the upload is no longer held in memory, please upload it again")
 
-        # 3. Update the session state variables for this page
-        st.session_state.captured_image = image
+        # Update the session state variables for this page
+        st.session_state.captured_stored = stored
         st.session_state.image_source = 'upload' # Force the source to 'upload'
 
         # Display a subtle message to confirm data transfer
@@ -39,159 +53,342 @@ if st.session_state.uploaded_file_object is not None:
 # --- Initialize session state variables for management ------------------------
 if "image_source" not in st.session_state:
     st.session_state.image_source = None  # 'upload' or 'map'
-if "uploaded_file_object" not in st.session_state:
-    st.session_state.uploaded_file_object = None
-if "captured_image" not in st.session_state:
-    st.session_state.captured_image = None
+if "uploaded_file_id" not in st.session_state:
+    st.session_state.uploaded_file_id = None  # only the id: the image store holds the bytes
 if "last_bbox" not in st.session_state:
     st.session_state.last_bbox = None
-
-tab_upload, tab_map = st.tabs(["📂 Upload an image", "🗺️ Explore the world"])
-with tab_upload:
-    st.info("Upload a satellite image")
-
-    uploaded = st.file_uploader(
-        "Use the button below",
-        type=["png", "jpg", "jpeg"],
-        key="file_uploader_key"
-    )
-
-    if uploaded and uploaded != st.session_state.uploaded_file_object:
-        # Check if the image currently stored is from the map tab
-        if st.session_state.image_source == 'map':
-            st.session_state.captured_image = None # Clear map image
-
-        # Process the new uploaded image
-        image = Image.open(uploaded).convert("RGB")
-        st.session_state.captured_image = image
-        st.session_state.image_source = 'upload' # Set source flag
-        st.session_state.uploaded_file_object = uploaded # Store the file object reference
-
-        # Display image shape
-        img_array = np.array(image)
-        st.write(f'Image shape: {img_array.shape}')
-
-with tab_map:
-    st.info(
-        "Browse and zoom in and out the map as you wish below to select an area, then click 'Capture View'."
-    )
-    MAPBOX_TOKEN = st.secrets["MAPBOX_TOKEN"]
-    # Initialize Folium Map
-    m = folium.Map(
+if "image_store" not in st.session_state:
+    st.session_state.image_store = ImageStore()  # session images, within a memory budget
+if "captured_stored" not in st.session_state:
+    st.session_state.captured_stored = None  # StoredImage of the current input (upload or capture)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # owner of this session's background jobs
+if "fine_tuning_job" not in st.session_state:
+    st.session_state.fine_tuning_job = None  # id of the label job of this page
+if "fine_tuning_speculative" not in st.session_state:
+    st.session_state.fine_tuning_speculative = None  # id of the job started ahead of the click, if any
+if "fine_tuning_trace" not in st.session_state:
+    st.session_state.fine_tuning_trace = None  # stage timings of that job, until its result is shown
+if "fine_tuning_export_job" not in st.session_state:
+    st.session_state.fine_tuning_export_job = None  # id of the GIS export job of the current prediction
+if "agreement_job" not in st.session_state:
+    st.session_state.agreement_job = None  # id of the comparison job with the initial model
+
+# -------------------- MAP (fragment) ------------------------------------------
+
+def build_map(token):
+    """Folium map with the Mapbox satellite tile layer."""
+    return folium.Map(
         location=INITIAL_CENTER,
         zoom_start=INITIAL_ZOOM,
-        tiles=f"https://api.mapbox.com/styles/v1/{MAPBOX_STYLE}/tiles/{{z}}/{{x}}/{{y}}@2x?access_token={MAPBOX_TOKEN}",
+        tiles=f"https://api.mapbox.com/styles/v1/{MAPBOX_STYLE}/tiles/{{z}}/{{x}}/{{y}}@2x?access_token={token}",
         attr="Mapbox",
         control_scale=True,
         scrollWheelZoom=True
     )
 
+
+@st.fragment
+def map_section(token):
+    """Map and capture controls: panning or zooming reruns this section only.
+
+    A capture stores the image and bbox in the session state, then reruns
+    the page once so the input and result sections pick it up.
+    """
     # Display the map and capture its state (bounding box and zoom)
-    map_data = st_folium(m, width=700, height=500, key="folium_map", return_on_hover=False)
+    map_data = st_folium(
+        st.session_state.base_map, width=700, height=500, key="folium_map",
+        return_on_hover=False, returned_objects=["bounds"],
+    )
 
     if st.button("📸 Capture View"):
         if map_data and 'bounds' in map_data:
             # Check if the image currently stored is from the upload tab
             if st.session_state.image_source == 'upload':
-                st.session_state.captured_image = None # Clear uploaded image
+                st.session_state.captured_stored = None # Clear uploaded image
 
             # The 'bounds' dictionary contains the NorthEast (NE) and SouthWest (SW) corners
             # of the current map view (bounding box - bbox).
-            sw_lat = map_data['bounds']['_southWest']['lat']
-            sw_lon = map_data['bounds']['_southWest']['lng']
-            ne_lat = map_data['bounds']['_northEast']['lat']
-            ne_lon = map_data['bounds']['_northEast']['lng']
-            bbox_string = f"{sw_lon},{sw_lat},{ne_lon},{ne_lat}"
-            st.session_state.last_bbox = bbox_string
-
-            # --- Static Images API Call ---
+            bbox = bbox_from_bounds(map_data['bounds'])
+            st.session_state.last_bbox = bbox_string(bbox)
+
+            # --- Static Images API Call (cached on style, bbox, size and padding) ---
             image_width = 512
             image_height = 512
-            static_api_url = f"https://api.mapbox.com/styles/v1/{MAPBOX_STYLE}/static/[{bbox_string}]/{image_width}x{image_height}?access_token={MAPBOX_TOKEN}&padding=0.1"
 
-            with st.spinner("Fetching static map image..."):
+            with st.spinner("Fetching static map image..."), metrics.trace("capture", owner=st.session_state.session_id):
                 try:
-                    response = requests.get(static_api_url)
-                    response.raise_for_status()
-
-                    image = Image.open(BytesIO(response.content)).convert("RGB")
-                    st.session_state.captured_image = image
+                    image = fetch_static_bbox(bbox, token, image_width, image_height, padding=0.1)
+                    with metrics.stage("store"):
+                        # The capture keeps its location: predictions of it can be exported to GIS
+                        st.session_state.captured_stored = st.session_state.image_store.add_image(
+                            f"map:{st.session_state.last_bbox}", image, "map capture",
+                            bounds=static_bbox_bounds(bbox, image_width, image_height, padding=0.1),
+                        )
                     st.session_state.image_source = 'map' # Set source flag
 
-                    st.success("✅ Map view captured!")
-
-                    # Display image shape
-                    img_array = np.array(image)
-                    st.write(f'Image shape: {img_array.shape}')
-                except requests.exceptions.RequestException as e:
+                    # Toast: survives the rerun that shows the capture in the rest of the page
+                    st.toast(f"✅ Map view captured! Image shape: {(image.height, image.width, 3)}")
+                    st.rerun()
+                except http_client.RequestException as e:
                     st.error(f"Error fetching image from Mapbox API: {e}")
-                    st.session_state.captured_image = None
+                    st.session_state.captured_stored = None
         else:
             st.warning("Please interact with the map first to set the view.")
 
+
+tab_upload, tab_map = st.tabs(["📂 Upload an image", "🗺️ Explore the world"])
+with tab_upload:
+    st.info("Upload a satellite image")
+
+    uploaded = st.file_uploader(
+        "Use the button below",
+        type=["png", "jpg", "jpeg"],
+        key="file_uploader_key"
+    )
+
+    if uploaded and uploaded.file_id != st.session_state.uploaded_file_id:
+        # Process the new uploaded image (kept encoded, replaces any map capture)
+        stored = st.session_state.image_store.add_upload(uploaded)
+        st.session_state.captured_stored = stored
+        st.session_state.image_source = 'upload' # Set source flag
+        st.session_state.uploaded_file_id = uploaded.file_id # Store the upload id
+
+        # Display image shape
+        st.write(f'Image shape: {stored.shape}')
+
+    # Large photos are resampled on the client to the model's ground resolution instead of being shipped full size
+    st.checkbox("⚡ Pre-scale to the model's ground resolution", value=False, key="prescale")
+    st.number_input(
+        "Ground resolution of the image (m / pixel, 0 if unknown)",
+        min_value=0.0, value=0.0, step=0.05, key="ground_resolution",
+    )
+    if st.session_state.prescale and not st.session_state.ground_resolution:
+        st.caption("Pre-scaling needs the ground resolution: until then the image is sent as is.")
+
+with tab_map:
+    st.info(
+        "Browse and zoom in and out the map as you wish below to select an area, then click 'Capture View'."
+    )
+    MAPBOX_TOKEN = st.secrets["MAPBOX_TOKEN"]
+    # Initialize Folium Map (once per session, reused by every rerun)
+    if "base_map" not in st.session_state:
+        st.session_state.base_map = build_map(MAPBOX_TOKEN)
+    map_section(MAPBOX_TOKEN)
+
 # -------------------- API CALL ------------------------------------------------
 
-if st.session_state.captured_image:
-    st.markdown("### ✅ Input image")
-    # Display the captured image, this replaces the previous uploaded file display
-    st.image(st.session_state.captured_image, use_container_width=False)
-
-    if st.button("🚀 Generate Label Image"):
-        # Existing API logic
-        buffer = BytesIO()
-        st.session_state.captured_image.save(buffer, format="PNG")
-        buffer.seek(0)
-
-        files = {"file": ("input.png", buffer.read(), "image/png")}
-
-        with st.spinner("Processing image..."):
-            response = requests.post(API_ENDPOINT_LATEST, files=files)
-
-        if response.status_code == 200:
-            output_image = Image.open(BytesIO(response.content))
-
-            st.markdown("### 🖼️ Result")
-            st.success("✅ Image successfully processed")
-
-            col1, col2, col3 = st.columns([2, 2, 1])
-
-            with col1:
-                st.caption("Input image")
-                st.image(st.session_state.captured_image, use_container_width=False)
-
-            with col2:
-                st.caption("Predicted label")
-                st.image(output_image, use_container_width=False)
-                if st.session_state.image_source == 'upload':
-                    st.markdown("🥳 Mean IoU is 0.79")
-
-            with col3:
-                if st.session_state.image_source == 'upload':
-                    st.caption("🗂️ Legend")
-
-                    try:
-                        for _, (label, color) in DICO_LABEL.items():
-                            st.markdown(
-                                f"""
-                                <div style="
-                                    display: flex;
-                                    align-items: center;
-                                    margin-bottom: 6px;
-                                ">
-                                    <div style="
-                                        width: 18px;
-                                        height: 18px;
-                                        background-color: {color};
-                                        border: 1px solid #333;
-                                        margin-right: 10px;
-                                    "></div>
-                                    <span>{label}</span>
-                                </div>
-                                """,
-                                unsafe_allow_html=True
-                            )
-                    except NameError:
-                        st.warning("DICO_LABEL is not defined to display the legend.")
+def predict_label(stored, use_prescale, ground_resolution):
+    """Label image of ``stored``; runs in a job worker, so no ``st.*`` calls."""
+    if use_prescale:
+        # Send the image at the model's resolution, map the mask back to full size
+        prescaled = prescale(stored.image, MODEL, ground_resolution)
+        return restore(segment(prescaled.image, MODEL.endpoint, class_data=DICO_LABEL), prescaled)
+    # Inputs go out as their stored file, without re-encoding
+    return segment(
+        stored.image, MODEL.endpoint, class_data=DICO_LABEL,
+        digest=stored.pixel_digest, original=stored.data,
+    )
 
-        else:
-            st.error(f"API error ({response.status_code}): {response.text}")
+
+def agreement_section(stored):
+    """Where the fine-tuned model agrees with the initial one, in the reduced classes."""
+    initial = MODELS["initial"]
+    key = f"agreement:{initial.endpoint}:{MODEL.endpoint}:{stored.digest}"
+    job = JOBS.get(st.session_state.agreement_job)
+    if job is not None and job.key != key:
+        JOBS.cancel(job.id)
+        job = None
+
+    if st.button("🔀 Compare with the initial model", key="compare_initial"):
+        # Both masks come from the prediction cache once predicted, the report too
+        job = JOBS.submit(
+            compare_models, stored.image, initial, MODEL,
+            digest=stored.pixel_digest, original=stored.data,
+            key=key, owner=st.session_state.session_id,
+        )
+        st.session_state.agreement_job = job.id
+    if job is None:
+        return
+
+    if not job.done():
+        job_status(job, lambda job: f"⏳ Comparing the models... ({job.elapsed:.0f} s)")
+        return
+    if job.error is not None:
+        st.error(str(job.error))
+    if job.result is None:
+        return
+
+    report, agreement = job.result
+    names = class_names(DICO_LABEL)
+    st.markdown("### 🔀 Agreement with the initial model")
+    st.caption(f"The {len(FLAIR_CLASS_DATA)} classes of the initial model are mapped onto the {len(names)} fine-tuned ones")
+    col1, col2 = st.columns([2, 3])
+    with col1:
+        if report["agreement"] is not None:
+            st.metric("Pixel agreement", f"{report['agreement']:.0%}")
+        st.image(agreement, caption="In red: the models disagree", use_container_width=False)
+    with col2:
+        st.caption("Pixels per class: initial model (rows), fine-tuned model (columns)")
+        st.dataframe(
+            [{"initial": name, **dict(zip(names, row))} for name, row in zip(names, report["matrix"])],
+            hide_index=True,
+        )
+        if report["hotspots"]:
+            st.caption(f"Tiles ({report['tile_size']} px) where they disagree the most")
+            st.dataframe(
+                [
+                    {"tile (left, top, right, bottom)": str(tuple(spot["box"])),
+                     "disagreement": f"{spot['disagreement']:.0%}"}
+                    for spot in report["hotspots"]
+                ],
+                hide_index=True,
+            )
+
+
+@st.fragment
+def result_section(evaluation):
+    """Input image and prediction: generating reruns this section only.
+
+    ``evaluation`` is the model's job on the evaluation set, shown next to uploads.
+    """
+    stored = st.session_state.captured_stored
+    if stored:
+        captured_image = stored.image  # decoded again if the store released it
+        st.markdown("### ✅ Input image")
+        # Display the captured image, this replaces the previous uploaded file display
+        st.image(captured_image, use_container_width=False)
+
+        # One job per input and options: a job left running for a previous input is cancelled
+        options = (
+            st.session_state.image_source == 'upload'
+            and bool(st.session_state.get("prescale") and st.session_state.get("ground_resolution")),
+            st.session_state.get("ground_resolution") or None,
+        )
+        job_key = f"{MODEL.endpoint}:{stored.digest}:{options}"
+        job = JOBS.get(st.session_state.fine_tuning_job)
+        if job is not None and job.key != job_key:
+            JOBS.cancel(job.id)
+            job = None
+
+        # Speculative mode: start on a new input right away, so the click below
+        # finds the same job (same key) running or done
+        speculative = JOBS.get(st.session_state.fine_tuning_speculative)
+        if speculative is not None and speculative.key != job_key:
+            JOBS.cancel(speculative.id)
+            speculative = None
+        if speculative is None and st.session_state.get("speculative"):
+            speculative = JOBS.submit(
+                predict_label, stored, *options,
+                key=job_key, owner=st.session_state.session_id,
+                limit=SPECULATIVE_MAX_JOBS,
+            )
+            st.session_state.fine_tuning_speculative = speculative and speculative.id
+
+        health = MONITOR.status(MODEL_KEY)
+        if health != READY:
+            st.caption(
+                "🔴 The model did not answer its last health check" if health == DOWN
+                else "🟡 The model is waking up: the first prediction may take up to a minute"
+            )
+
+        if st.button("🚀 Generate Label Image"):
+            # Runs in the background job pool, so the page stays responsive and the
+            # result survives reruns and page changes. Cached on the image content +
+            # endpoint: repeat clicks skip the API
+            trace = metrics.start_trace("predict", MODEL.endpoint, st.session_state.session_id)
+            with metrics.activate(trace):
+                job = JOBS.submit(
+                    predict_label, stored, *options,
+                    key=job_key, owner=st.session_state.session_id,
+                )
+            st.session_state.fine_tuning_job = job.id
+            st.session_state.fine_tuning_trace = trace
+
+        if job is not None and not job.done():
+            if st.button("✖️ Cancel", key="cancel_job"):
+                JOBS.cancel(job.id)
+            # Polled from its own fragment: the page never waits on the job
+            job_status(job, lambda job: f"⏳ Processing image... ({job.status}, {job.elapsed:.0f} s)")
+
+        if job is not None and job.done():
+            render_start = time.perf_counter()
+            output_image, api_error = job.result, job.error
+            if output_image is not None:
+                st.markdown("### 🖼️ Result")
+                st.success("✅ Image successfully processed")
+                upload = output_image.info.get("upload", {})
+                if upload:
+                    st.caption(
+                        f"Sent {upload['bytes'] / 1024:.0f} KB ({upload['encoder']}, "
+                        f"encoded in {upload['seconds'] * 1000:.0f} ms)"
+                    )
+                elif upload is None:
+                    st.caption("⚡ Served from the prediction cache")
+                if job.id == st.session_state.fine_tuning_speculative:
+                    st.caption("⚡ Started in the background before the click")
+
+                col1, col2, col3 = st.columns([2, 2, 1])
+
+                with col1:
+                    st.caption("Input image")
+                    st.image(captured_image, use_container_width=False)
+
+                with col2:
+                    st.caption("Predicted label")
+                    st.image(output_image, use_container_width=False)
+                    if st.session_state.image_source == 'upload':
+                        iou_panel(output_image, DICO_LABEL, evaluation)
+
+                with col3:
+                    if st.session_state.image_source == 'upload':
+                        st.caption("🗂️ Legend")
+
+                        try:
+                            for _, (label, color) in DICO_LABEL.items():
+                                st.markdown(
+                                    f"""
+                                    <div style="
+                                        display: flex;
+                                        align-items: center;
+                                        margin-bottom: 6px;
+                                    ">
+                                        <div style="
+                                            width: 18px;
+                                            height: 18px;
+                                            background-color: {color};
+                                            border: 1px solid #333;
+                                            margin-right: 10px;
+                                        "></div>
+                                        <span>{label}</span>
+                                    </div>
+                                    """,
+                                    unsafe_allow_html=True
+                                )
+                        except NameError:
+                            st.warning("DICO_LABEL is not defined to display the legend.")
+
+                if stored.bounds is not None:
+                    export_panel(stored, output_image, MODEL_KEY, "fine_tuning_export_job")
+
+                agreement_section(stored)
+
+            elif api_error is not None:
+                st.error(str(api_error))
+
+            trace = st.session_state.fine_tuning_trace
+            if trace is not None and not trace.finished:
+                trace.add("render", time.perf_counter() - render_start)
+                trace.finish()
+
+
+st.sidebar.toggle(
+    "⚡ Speculative inference", value=False, key="speculative",
+    help="Start the prediction as soon as an image is uploaded or captured: the result is ready on click",
+)
+# The evaluation set is scanned once per run, not on every rerun of the section
+result_section(evaluation_job(MODEL) if st.session_state.image_source == 'upload' else None)
+
+# -------------------- SIDEBAR PANELS ------------------------------------------
+
+render_sidebar_panels()
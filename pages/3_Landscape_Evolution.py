@@ -1,13 +1,23 @@
 import streamlit as st
 from PIL import Image
-import requests
 from io import BytesIO
+import numpy as np
+import pandas as pd
 
 # constants and dictionaries
-from utils.constants import MAPBOX_STYLE, INITIAL_CENTER, INITIAL_ZOOM, API_ENDPOINT_INITIAL, REDUCED_7
+from utils.constants import MAPBOX_STYLE, INITIAL_CENTER, INITIAL_ZOOM, REDUCED_7, FLAIR_CLASS_DATA, CLASS_GROUPS, FLAIR_TO_REDUCED_7
+from utils.labels import rgb_to_index, class_names, class_percentages, group_percentages
+from utils.change import remap, transition_matrix, change_summary, change_map
+from utils.segmentation import segment_images
+from utils.image_store import ImageStore
+from utils.models import MODELS
+from utils.health import MONITOR
 
 st.header("⌛ Landscape Evolution")
 
+MODEL_KEY = "initial"
+MODEL = MODELS[MODEL_KEY]
+
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     st.subheader("💰 Las Vegas through time 💰")
@@ -44,13 +54,42 @@ with col2:
     st.subheader("2002")
     st.image(img2, width=325)
 
+@st.cache_data
+def label_index(path):
+    """Class-index array of a saved FLAIR label image."""
+    return rgb_to_index(np.asarray(Image.open(path)), FLAIR_CLASS_DATA)
+
+
+@st.cache_data
+def artificialisation_rate(path):
+    """Share of artificialised land in a saved FLAIR label image, in %."""
+    # The saved demo labels have a white frame: don't count it as "snow"
+    percentages = class_percentages(label_index(path), FLAIR_CLASS_DATA, exclude=("snow",))
+    return round(group_percentages(percentages, CLASS_GROUPS)["artificialised"], 1)
+
+
+@st.cache_data
+def land_changes(path_before, path_after, reduced):
+    """Transition matrix, net change table and change map between two labels."""
+    before, after = label_index(path_before), label_index(path_after)
+    class_data = FLAIR_CLASS_DATA
+    if reduced:
+        before, after = remap(before, FLAIR_TO_REDUCED_7), remap(after, FLAIR_TO_REDUCED_7)
+        class_data = REDUCED_7
+    names = class_names(class_data)
+    matrix = transition_matrix(before, after, len(names))
+    transitions = pd.DataFrame(matrix, index=names, columns=names)
+    summary = pd.DataFrame.from_dict(change_summary(matrix, class_data), orient="index")
+    return transitions, summary, change_map(before, after, class_data)
+
+
 lab1 = Image.open("default/label_1972.png")
 lab2 = Image.open("default/label_2002.png")
 
 col1, col2 = st.columns(2)
 
-perc_72 = 19.3 + 19.2
-perc_02 = 12.3 + 71.7
+perc_72 = artificialisation_rate("default/label_1972.png")
+perc_02 = artificialisation_rate("default/label_2002.png")
 
 with col1:
     st.image(lab1, width=325)
@@ -60,62 +99,71 @@ with col2:
     st.image(lab2, width=325)
     st.markdown(f"Land artificialisation rate: {perc_02} %")
 
-# Allow multiple files
-# uploaded_files = st.file_uploader(
-#     "Upload 2 or 3 satellite images (same location, different years)",
-#     type=["png", "jpg", "jpeg", "tif", "tiff"],
-#     accept_multiple_files=True,
-#     key="surface_evolution_uploader",
-# )
-# 19.31304931640625 19.2962646484375 12.3321533203125 71.70257568359375
-
-# if uploaded_files:
-#     n_files = len(uploaded_files)
-
-#     if n_files < 2:
-#         st.warning("Please upload **at least 2 images**.")
-#         st.stop()
-
-#     if n_files > 3:
-#         st.warning("Please upload **maximum 3 images**.")
-#         st.stop()
-#     else:
-#         # Open input images
-#         images = [Image.open(f).convert("RGB") for f in uploaded_files]
-
-#         st.markdown("### ✅ Input images")
-#         cols = st.columns(3)
-#         for i, (col, img, f) in enumerate(zip(cols, images, uploaded_files), start=1):
-#             with col:
-#                 st.image(img, caption=f"Image {i}: {f.name}", use_container_width=True)
-
-#         if st.button("🚀 Run model on 3 images", key="run_surface_evolution"):
-#             predictions = []
-
-#             with st.spinner("Running the model on all images..."):
-#                 for img in images:
-#                     # Prepare buffer for API
-#                     buf = BytesIO()
-#                     img.save(buf, format="PNG")
-#                     buf.seek(0)
-
-#                     files = {"file": ("input.png", buf.read(), "image/png")}
-
-#                     # 🔴 IMPORTANT: API_ENDPOINT should be the endpoint of the ONE model you want
-#                     # e.g. API_ENDPOINT_MODEL_1 or whatever you chose earlier
-#                     resp = requests.post(API_ENDPOINT_INITIAL, files=files)
-
-#                     if resp.status_code == 200:
-#                         pred_img = Image.open(BytesIO(resp.content))
-#                         predictions.append(pred_img)
-#                     else:
-#                         st.error(f"API call failed with status code {resp.status_code}")
-#                         predictions = []
-#                         break
-
-#             if predictions:
-#                 st.markdown("### 🧠 Model outputs (aligned horizontally)")
-#                 out_cols = st.columns(3)
-#                 for i, (col, pred) in enumerate(zip(out_cols, predictions), start=1):
-#                     with col:
-#                         st.image(pred, caption=f"Prediction {i}", use_container_width=True)
+# -------------------- CHANGE DETECTION ----------------------------------------
+st.markdown("### 🔀 What changed between 1972 and 2002")
+reduced = st.toggle("Group into the 7 reduced classes", value=True, key="change_reduced")
+transitions, summary, changes = land_changes("default/label_1972.png", "default/label_2002.png", reduced)
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.caption("Changed pixels (colored by their 2002 class)")
+    st.image(changes, width=325)
+
+with col2:
+    st.caption("Net gain / loss per class")
+    st.dataframe(summary[summary[["gain", "loss"]].sum(axis=1) > 0].style.format({"net %": "{:+.1f}"}))
+
+with st.expander("Full transition matrix (rows: 1972, columns: 2002, in pixels)"):
+    st.dataframe(transitions)
+
+# -------------------- YOUR OWN TIME SERIES ------------------------------------
+st.markdown("---")
+st.subheader("📅 Your own time series")
+
+uploaded_files = st.file_uploader(
+    "Upload 2 or more satellite images (same location, different years)",
+    type=["png", "jpg", "jpeg", "tif", "tiff"],
+    accept_multiple_files=True,
+    key="surface_evolution_uploader",
+)
+
+if uploaded_files:
+    n_files = len(uploaded_files)
+
+    if n_files < 2:
+        st.warning("Please upload **at least 2 images**.")
+        st.stop()
+
+    # Wake the model up while the dates are read and shown
+    MONITOR.watch(MODEL_KEY)
+
+    # Keep each date in the session store: reruns reuse the images already read
+    if "image_store" not in st.session_state:
+        st.session_state.image_store = ImageStore()
+    store = st.session_state.image_store
+    images = [stored.image for stored in store.add_uploads(uploaded_files)]
+    n_cols = min(n_files, 3)
+
+    st.markdown("### ✅ Input images")
+    cols = st.columns(n_cols)
+    for i, (img, f) in enumerate(zip(images, uploaded_files)):
+        with cols[i % n_cols]:
+            st.image(img, caption=f"Image {i + 1}: {f.name}", use_container_width=True)
+
+    if st.button(f"🚀 Run model on {n_files} images", key="run_surface_evolution"):
+        st.markdown("### 🧠 Model outputs (aligned horizontally)")
+        out_cols = st.columns(n_cols)
+        slots = []
+        for i in range(n_files):
+            with out_cols[i % n_cols]:
+                slots.append(st.empty())
+                slots[i].info(f"⏳ Prediction {i + 1}...")
+
+        # Dates run in parallel; already-seen dates come straight from the cache
+        for i, pred, seconds, error in segment_images(images, MODEL.endpoint, class_data=MODEL.class_data):
+            with slots[i].container():
+                if error is None:
+                    st.image(pred, caption=f"Prediction {i + 1} ({seconds:.2f} s)", use_container_width=True)
+                else:
+                    st.error(f"API call failed for image {i + 1}: {str(error)[:500]}")
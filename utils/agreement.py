@@ -0,0 +1,165 @@
+# utils/agreement.py
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import metrics
+from utils.cache import make_key
+from utils.change import class_mapping, remap
+from utils.constants import TILE_SIZE, AGREEMENT_HOTSPOTS
+from utils.encoding import encode_image
+from utils.evaluation import iou_scores
+from utils.labels import CHUNK_PIXELS, class_names, palette
+from utils.segmentation import PREDICTION_CACHE, image_digest, prediction_key, segment_mask
+
+DISAGREE_COLOR = (255, 0, 0)
+AGREE_DIMMING = 3      # agreeing pixels are drawn in their class color / 3
+
+
+def common_classes(class_data_a, class_data_b):
+    """Shared taxonomy of two models: ``(class_data, mapping_a, mapping_b)``.
+
+    The finer class map is mapped onto the coarser one through the declared
+    ``CLASS_MAPPINGS`` (e.g. FLAIR onto REDUCED_7); mappings are None for
+    the side already in the shared classes.
+    """
+    try:
+        return class_data_b, class_mapping(class_data_a, class_data_b), None
+    except ValueError:
+        return class_data_a, None, class_mapping(class_data_b, class_data_a)
+
+
+def compare_masks(mask_a, mask_b, n_classes, tile_size=TILE_SIZE):
+    """Cross-model confusion matrix and per-tile disagreement of two aligned masks.
+
+    ``matrix[i, j]`` counts pixels of class ``i`` in ``mask_a`` and ``j`` in
+    ``mask_b``. ``disagree`` / ``valid`` count, per ``tile_size`` tile, the
+    pixels the models classify differently and those both classify at all
+    (UNKNOWN is skipped). Masks are read in bands of whole tile rows, so
+    stitched full-resolution (or memory-mapped) masks never get copied whole.
+    """
+    if mask_a.shape != mask_b.shape:
+        raise ValueError(f"Masks are not aligned: {mask_a.shape} vs {mask_b.shape}")
+    height, width = mask_a.shape[:2]
+    cols = np.arange(0, width, tile_size)
+    grid = (-(-height // tile_size), len(cols))
+    matrix = np.zeros(n_classes * n_classes, dtype=np.int64)
+    disagree = np.zeros(grid, dtype=np.int64)
+    valid = np.zeros(grid, dtype=np.int64)
+
+    band = tile_size * max(1, CHUNK_PIXELS // (tile_size * max(width, 1)))
+    for top in range(0, height, band):
+        a = np.asarray(mask_a[top:top + band])
+        b = np.asarray(mask_b[top:top + band])
+        ok = (a < n_classes) & (b < n_classes)
+        matrix += np.bincount(
+            a[ok].astype(np.int64) * n_classes + b[ok], minlength=n_classes * n_classes
+        )
+        rows = np.arange(0, a.shape[0], tile_size)
+        first = top // tile_size
+        for counts, pixels in ((disagree, ok & (a != b)), (valid, ok)):
+            per_row = np.add.reduceat(pixels, rows, axis=0, dtype=np.int64)
+            counts[first:first + len(rows)] = np.add.reduceat(per_row, cols, axis=1)
+    return matrix.reshape(n_classes, n_classes), disagree, valid
+
+
+def hotspots(disagree, valid, shape, tile_size=TILE_SIZE, top=AGREEMENT_HOTSPOTS):
+    """Tiles of a ``shape`` mask where the models disagree the most, worst first.
+
+    Tiles less than a quarter classified by both models (image borders,
+    no-data) are left out.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(valid * 4 >= tile_size * tile_size, disagree / valid, np.nan)
+    order = np.argsort(np.nan_to_num(share, nan=-1.0), axis=None)[::-1][:top]
+    spots = []
+    for row, col in zip(*np.unravel_index(order, share.shape)):
+        if np.isnan(share[row, col]) or not disagree[row, col]:
+            break
+        left, upper = int(col) * tile_size, int(row) * tile_size
+        spots.append({
+            "row": int(row),
+            "col": int(col),
+            "box": (left, upper, min(left + tile_size, shape[1]), min(upper + tile_size, shape[0])),
+            "disagreement": float(share[row, col]),
+        })
+    return spots
+
+
+def agreement_report(matrix, disagree, valid, shape, class_data, tile_size=TILE_SIZE):
+    """Agreement figures of a ``compare_masks`` result (JSON friendly)."""
+    per_class, _, agreement = iou_scores(matrix)
+    return {
+        "pixels": int(matrix.sum()),
+        "agreement": agreement,
+        "classes": {
+            name: None if np.isnan(value) else float(value)
+            for name, value in zip(class_names(class_data), per_class)
+        },
+        "matrix": matrix.tolist(),
+        "tile_size": tile_size,
+        "tiles": disagree.size,
+        "tiles_disagreeing": int((disagree > 0).sum()),
+        "hotspots": hotspots(disagree, valid, shape, tile_size),
+    }
+
+
+def agreement_map(mask_a, mask_b, class_data, out=None):
+    """RGB image of where two aligned masks agree (dimmed class color) or not (red).
+
+    Written band by band into ``out`` when given (e.g. a memory map).
+    """
+    height, width = mask_a.shape[:2]
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    class_colors = palette(class_data)
+    colors[:len(class_colors)] = class_colors // AGREE_DIMMING
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    rows = max(1, CHUNK_PIXELS // max(width, 1))
+    for top in range(0, height, rows):
+        a = np.asarray(mask_a[top:top + rows])
+        b = np.asarray(mask_b[top:top + rows])
+        band = colors[a]
+        band[a != b] = DISAGREE_COLOR
+        out[top:top + rows] = band
+    return out
+
+
+def _masks(image, models, digest, original):
+    """Class-index masks of ``image`` by every model, predicted concurrently."""
+    misses = [model for model in models if prediction_key(digest, model.endpoint) not in PREDICTION_CACHE]
+    payload = encode_image(image, original) if misses else None
+    with ThreadPoolExecutor(max_workers=len(models)) as pool:
+        futures = [
+            pool.submit(metrics.bind(segment_mask), image, model.endpoint, model.class_data, digest, payload)
+            for model in models
+        ]
+        return [future.result() for future in futures]
+
+
+def compare_models(image, model_a, model_b, digest=None, original=None, tile_size=TILE_SIZE):
+    """Agreement of two models on ``image``, in their shared taxonomy.
+
+    Returns ``(report, agreement_map)``. The masks come from the prediction
+    cache when already predicted, and the report is cached there too, next
+    to them.
+    """
+    digest = digest or image_digest(image)
+    class_data, mapping_a, mapping_b = common_classes(model_a.class_data, model_b.class_data)
+    mask_a, mask_b = _masks(image, (model_a, model_b), digest, original)
+    if mapping_a:
+        mask_a = remap(mask_a, mapping_a)
+    if mapping_b:
+        mask_b = remap(mask_b, mapping_b)
+
+    key = make_key("agreement", digest, model_a.endpoint, model_b.endpoint, str(tile_size))
+    cached = PREDICTION_CACHE.get(key)
+    if cached is not None:
+        report = json.loads(cached)
+    else:
+        matrix, disagree, valid = compare_masks(mask_a, mask_b, len(class_names(class_data)), tile_size)
+        report = agreement_report(matrix, disagree, valid, mask_a.shape, class_data, tile_size)
+        PREDICTION_CACHE.set(key, json.dumps(report).encode())
+    report["models"] = (model_a.name, model_b.name)
+    return report, agreement_map(mask_a, mask_b, class_data)
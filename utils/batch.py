@@ -0,0 +1,235 @@
+# utils/batch.py
+import json
+import os
+import time
+from collections import namedtuple
+from io import BytesIO
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+from utils import http_client
+from utils.constants import BATCH_WORKERS, BATCH_RETRIES, BATCH_BACKOFF, TILE_OVERLAP
+from utils.labels import class_percentages, decode_mask, palette, rgb_to_index
+from utils.raster import is_tiff, open_raster
+from utils.segmentation import APIError, predict
+from utils.tiling import segment_tiled
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+# id: stable name of the image in the run (relative path), used to resume
+BatchItem = namedtuple("BatchItem", ["id", "path"])
+
+
+# -------------------- INPUTS --------------------
+
+def find_images(root):
+    """Every image under ``root``, in a stable order."""
+    items = []
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(directory, name)
+                items.append(BatchItem(os.path.relpath(path, root).replace(os.sep, "/"), path))
+    return items
+
+
+def _check_id(item_id):
+    """Ids name the masks under the output directory: no absolute or ``..`` ones."""
+    parts = item_id.replace("\\", "/").split("/")
+    if not item_id or os.path.isabs(item_id) or not parts[0] or ".." in parts:
+        raise ValueError(f"Image id {item_id!r} must be a path relative to the manifest directory")
+    return item_id
+
+
+def read_manifest(path):
+    """Images listed in a manifest: one path per line, or JSONL with a ``path``
+    (and optional ``id``) per line. Relative paths start at the manifest.
+
+    Ids default to the image path relative to the manifest directory; images
+    outside it need an explicit ``id``. Absolute, ``..`` and duplicate ids are
+    rejected.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    seen = {}   # id -> image path: two images must not share a mask
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            image_path = os.path.normpath(os.path.join(base, entry["path"]))
+            item_id = entry.get("id") or os.path.relpath(image_path, base).replace(os.sep, "/")
+            try:
+                _check_id(item_id)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: {e}") from None
+            if seen.setdefault(item_id, image_path) != image_path:
+                raise ValueError(f"{path}:{number}: id {item_id!r} already names {seen[item_id]}")
+            items.append(BatchItem(item_id, image_path))
+    return items
+
+
+def completed_ids(manifest_path):
+    """Ids already segmented by a previous run writing ``manifest_path``."""
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # line cut short by an interrupted run
+            if record.get("status") == "ok":
+                done.add(record["id"])
+            else:
+                done.discard(record["id"])
+    return done
+
+
+# -------------------- ONE IMAGE --------------------
+
+def mask_path(out_dir, item_id):
+    """Where the mask of ``item_id`` goes: ``<out_dir>/masks/<id>.png``.
+
+    The id keeps its extension (``a.jpg`` -> ``a.jpg.png``) so images that
+    differ only by it don't share a mask, and the path must stay in ``masks``.
+    """
+    masks_dir = os.path.realpath(os.path.join(out_dir, "masks"))
+    path = os.path.realpath(os.path.join(masks_dir, f"{_check_id(item_id)}.png"))
+    if os.path.commonpath([masks_dir, path]) != masks_dir:
+        raise ValueError(f"Mask of {item_id!r} would be written outside {masks_dir}")
+    return path
+
+
+def save_mask(index, class_data, path):
+    """Class-index mask as a palette PNG: pixel values are class ids, shown in class colors."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mask = Image.fromarray(index, mode="L").convert("P")
+    mask.putpalette(palette(class_data).tobytes())
+    tmp_path = f"{path}.tmp"
+    mask.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+
+
+def _transient(error):
+    if isinstance(error, APIError):
+        return error.status_code in http_client.RETRY_STATUSES
+    return isinstance(error, http_client.RequestException)
+
+
+def _image_size(path):
+    if is_tiff(path):
+        raster = open_raster(path)
+        try:
+            return raster.size
+        finally:
+            raster.close()
+    with Image.open(path) as image:
+        return image.size
+
+
+def predict_index(path, model, tile_size=0, overlap=TILE_OVERLAP):
+    """(H, W) class-index mask of the image at ``path``, plus its size."""
+    width, height = _image_size(path)
+    if tile_size and max(width, height) > tile_size:
+        # Large imagery: read and segment window by window
+        raster = open_raster(path)
+        try:
+            label = segment_tiled(
+                raster, model.endpoint, tile_size=tile_size, overlap=overlap, class_data=model.class_data
+            )
+        finally:
+            raster.close()
+        return rgb_to_index(label, model.class_data), (width, height)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with Image.open(BytesIO(data)) as decoded:
+        image = decoded.convert("RGB")
+    # Sent as the original file when the backend reads its format
+    content = predict(image, model.endpoint, original=data)
+    return decode_mask(content, model.class_data), (width, height)
+
+
+def process(item, model, out_dir, retries=BATCH_RETRIES, tile_size=0, overlap=TILE_OVERLAP):
+    """Segment one image and save its mask; returns its manifest record."""
+    record = {"id": item.id, "path": item.path, "status": "error", "attempts": 0}
+    start = time.perf_counter()
+    try:
+        path = mask_path(out_dir, item.id)
+    except ValueError as e:
+        record["error"] = str(e)
+        record["seconds"] = 0.0
+        return record
+    for attempt in range(retries + 1):
+        record["attempts"] = attempt + 1
+        try:
+            index, (width, height) = predict_index(item.path, model, tile_size, overlap)
+            break
+        except (APIError, http_client.RequestException) as e:
+            record["error"] = str(e)
+            if attempt == retries or not _transient(e):
+                record["seconds"] = round(time.perf_counter() - start, 3)
+                return record
+            time.sleep(BATCH_BACKOFF * 2 ** attempt)
+        except (OSError, ValueError) as e:
+            record["error"] = f"Could not read image: {e}"
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            return record
+    predicted = time.perf_counter()
+
+    save_mask(index, model.class_data, path)
+    percentages = class_percentages(index, model.class_data)
+    record.pop("error", None)
+    record.update({
+        "status": "ok",
+        "mask": path,
+        "width": width,
+        "height": height,
+        "seconds": round(time.perf_counter() - start, 3),
+        "predict_seconds": round(predicted - start, 3),
+        "classes": {name: round(p, 3) for name, p in percentages.items() if p},
+    })
+    return record
+
+
+# -------------------- RUN --------------------
+
+def run_batch(items, model, out_dir, manifest_path=None, max_workers=BATCH_WORKERS, **options):
+    """Segment ``items`` with ``model``, appending one record per image to the manifest.
+
+    Images recorded as done in the manifest are skipped, so an interrupted
+    run resumes where it stopped (failed ones are tried again). At most
+    ``2 * max_workers`` images are queued at once. ``options`` go to
+    ``process``. Yields the records in completion order.
+    """
+    manifest_path = manifest_path or os.path.join(out_dir, "manifest.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    done = completed_ids(manifest_path)
+    todo = iter([item for item in items if item.id not in done])
+
+    with open(manifest_path, "a") as manifest, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        try:
+            while True:
+                for item in todo:
+                    pending.add(pool.submit(process, item, model, out_dir, **options))
+                    if len(pending) >= 2 * max_workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    record["model"] = model.name
+                    # One flushed line per image: the manifest is also the checkpoint
+                    manifest.write(json.dumps(record) + "\n")
+                    manifest.flush()
+                    yield record
+        finally:
+            for future in pending:
+                future.cancel()
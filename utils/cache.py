@@ -0,0 +1,206 @@
+# utils/cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(*parts):
+    """Build a stable hex key out of strings / bytes."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU cache of ``bytes`` values.
+
+    Values live in memory (bounded in bytes) and, when ``disk_dir`` is set, in
+    a second on-disk tier that survives restarts and is shared by every
+    session of the process. Entries older than ``ttl`` seconds are dropped.
+    """
+
+    def __init__(self, name, max_bytes, ttl=None, disk_dir=None, disk_max_bytes=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (timestamp, value)
+        self._bytes = 0
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+
+    # -------------------- public API --------------------
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put(key, value, now)
+        return value
+
+    def __contains__(self, key):
+        """Whether ``key`` is cached, without touching counters or LRU order."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0], now):
+                return True
+        if not self.disk_dir:
+            return False
+        try:
+            return not self._expired(os.stat(self._path(key)).st_mtime, now)
+        except OSError:
+            return False
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._put(key, value, now)
+        self._disk_set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self.disk_dir:
+                for path, _, _ in self._disk_files():
+                    _remove(path)
+                self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    # -------------------- memory tier --------------------
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _put(self, key, value, now):
+        if key in self._entries:
+            self._drop(key)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = (now, value)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    # -------------------- disk tier --------------------
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _disk_files(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_atime, stat.st_size))
+        return files
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self._expired(stat.st_mtime, now):
+                self._disk_remove(path, stat.st_size)
+                return None
+            with open(path, "rb") as f:
+                value = f.read()
+            # Keep mtime (TTL) but bump atime so the LRU order follows reads
+            os.utime(path, (now, stat.st_mtime))
+            return value
+        except OSError:
+            return None
+
+    def _disk_set(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError:
+            _remove(tmp_path)
+            return
+        with self._lock:
+            self._disk_bytes += len(value) - previous
+            if self.disk_max_bytes is not None and self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_remove(self, path, size):
+        if _remove(path):
+            with self._lock:
+                self._disk_bytes -= size
+
+    def _disk_evict(self):
+        # Called with the lock held: remove least recently read files first
+        files = sorted(self._disk_files(), key=lambda f: f[1])
+        self._disk_bytes = sum(size for _, _, size in files)
+        for path, _, size in files:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            if _remove(path):
+                self._disk_bytes -= size
+                self.evictions += 1
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
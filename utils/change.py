@@ -0,0 +1,87 @@
+# utils/change.py
+import numpy as np
+
+from utils.constants import FLAIR_CLASS_DATA, REDUCED_7, FLAIR_TO_REDUCED_7
+from utils.labels import UNKNOWN, CHUNK_PIXELS, palette, class_names
+
+UNCHANGED_COLOR = (40, 40, 40)
+
+# Declared taxonomy mappings: (source class map, target class map, class id mapping)
+CLASS_MAPPINGS = [
+    (FLAIR_CLASS_DATA, REDUCED_7, FLAIR_TO_REDUCED_7),
+]
+
+
+def remap(index, mapping):
+    """Translate class ids through ``mapping`` (e.g. FLAIR_TO_REDUCED_7)."""
+    lut = np.full(256, UNKNOWN, dtype=np.uint8)
+    for source, target in mapping.items():
+        lut[source] = target
+    return lut[index]
+
+
+def class_mapping(source, target):
+    """Declared mapping of ``source`` class ids onto ``target`` (None if they are the same)."""
+    if source == target:
+        return None
+    for mapped_source, mapped_target, mapping in CLASS_MAPPINGS:
+        if source == mapped_source and target == mapped_target:
+            return mapping
+    raise ValueError("No mapping declared between these class maps")
+
+
+def _blocks(*arrays):
+    """Flat, aligned blocks of ``arrays`` bounding temporaries on huge masks."""
+    flats = [np.asarray(a).reshape(-1) for a in arrays]
+    for start in range(0, flats[0].size, CHUNK_PIXELS):
+        yield [f[start:start + CHUNK_PIXELS] for f in flats]
+
+
+def transition_matrix(before, after, n_before, n_after=None):
+    """Pixel counts of every ``before`` class -> ``after`` class transition.
+
+    ``matrix[i, j]`` is the number of pixels of class ``i`` in ``before``
+    that are class ``j`` in ``after``. Pixels UNKNOWN in either map are
+    skipped. Both masks must be aligned (same shape).
+    """
+    if before.shape != after.shape:
+        raise ValueError(f"Masks are not aligned: {before.shape} vs {after.shape}")
+    n_after = n_before if n_after is None else n_after
+    matrix = np.zeros(n_before * n_after, dtype=np.int64)
+    for b, a in _blocks(before, after):
+        valid = (b < n_before) & (a < n_after)
+        codes = b[valid].astype(np.int64) * n_after + a[valid]
+        matrix += np.bincount(codes, minlength=n_before * n_after)
+    return matrix.reshape(n_before, n_after)
+
+
+def net_change(matrix):
+    """Per-class (gain, loss, net) pixel counts of a square transition matrix."""
+    stable = np.diag(matrix)
+    gain = matrix.sum(axis=0) - stable
+    loss = matrix.sum(axis=1) - stable
+    return gain, loss, gain - loss
+
+
+def change_summary(matrix, class_data):
+    """Net gain/loss per class, in pixels and % of the valid area."""
+    gain, loss, net = net_change(matrix)
+    total = matrix.sum() or 1
+    return {
+        name: {
+            "gain": int(g), "loss": int(l), "net": int(n),
+            "net %": float(100.0 * n / total),
+        }
+        for name, g, l, n in zip(class_names(class_data), gain, loss, net)
+    }
+
+
+def change_map(before, after, class_data):
+    """RGB image of the changed pixels, colored by their new class.
+
+    Unchanged pixels are drawn in dark grey so that changes stand out.
+    """
+    colors = np.vstack([palette(class_data), np.zeros((256 - max(class_data) - 1, 3), np.uint8)])
+    rendered = colors[after]
+    rendered[before == after] = UNCHANGED_COLOR
+    return rendered
@@ -1,4 +1,5 @@
 # utils/constants.py
+import os
 
 # Map Config
 MAPBOX_STYLE = "mapbox/satellite-v9"
@@ -9,6 +10,13 @@ INITIAL_ZOOM = 6
 API_ENDPOINT_INITIAL = 'https://carte-territoire-demo-24889736924.europe-west1.run.app/upload-and-process/' #"http://localhost:8000/upload-and-process/"
 API_ENDPOINT_LATEST = 'https://carte-territoire-demo-24889736924.europe-west1.run.app/upload-and-process-reduced/' #"http://localhost:8000/upload-and-process-reduced/"
 
+# Pitch app (app-pitch.py): one endpoint per mode, plus a GET test endpoint
+API_ENDPOINT_MODEL_1 = os.getenv("API_ENDPOINT_MODEL_1", "http://localhost:8000/upload-and-process")
+API_ENDPOINT_MODEL_2 = os.getenv("API_ENDPOINT_MODEL_2", "http://localhost:8000/upload-and-process")
+API_ENDPOINT_COMPARE = os.getenv("API_ENDPOINT_COMPARE", "http://localhost:8000/upload-and-process")
+API_ENDPOINT_EVOLUTION = os.getenv("API_ENDPOINT_EVOLUTION", "http://localhost:8000/upload-and-process")
+API_ENDPOINT_GET = os.getenv("API_ENDPOINT_GET", "http://localhost:8000/")
+
 # Color/Label Dictionaries
 FLAIR_CLASS_DATA = {
 0  : ['other','#000000'],
@@ -38,3 +46,121 @@ REDUCED_7 = {
     5: ["vegetation", "#095b30"],
     6: ["agriculture", '#fff30d']
 }
+
+
+# Prediction cache (memory + disk, shared by every session of the process)
+CACHE_DIR = os.getenv("CARTE_CACHE_DIR", ".cache")
+PREDICTION_CACHE_MAX_BYTES = 256 * 1024 * 1024      # in-memory tier
+PREDICTION_CACHE_DISK_MAX_BYTES = 2 * 1024 ** 3     # on-disk tier
+PREDICTION_CACHE_TTL = 7 * 24 * 3600                # seconds
+
+# HTTP client (timeouts are (connect, read) in seconds)
+HTTP_TIMEOUT = (5, 120)          # Cloud Run cold starts can take ~30 s
+MAPBOX_TIMEOUT = (5, 20)
+HTTP_MAX_RETRIES = 2
+HTTP_BACKOFF = 0.5               # seconds, doubled at each retry
+HTTP_POOL_SIZE = 16              # keep-alive connections per host
+HTTP_MAX_CONCURRENCY_PER_HOST = 8
+
+# Tiled segmentation of large images
+TILE_SIZE = 256                  # model input size, in pixels
+TILE_OVERLAP = 32
+TILE_WORKERS = 4                 # tiles in flight at once
+
+# Multi-date (surface evolution) inference
+SERIES_WORKERS = 3               # dates in flight at once
+
+# Model agreement analysis (initial vs fine-tuned model)
+AGREEMENT_HOTSPOTS = 10          # tiles of strongest disagreement reported
+
+# Class groups for surface statistics, by class name (names missing from a
+# class map are ignored, so the same groups work for FLAIR and REDUCED_7)
+CLASS_GROUPS = {
+    "artificialised": ["building", "impervious surface", "built surface"],
+}
+
+# FLAIR class id -> REDUCED_7 class id
+FLAIR_TO_REDUCED_7 = {
+    0: 0,    # other
+    1: 1,    # building
+    2: 2,    # pervious surface     -> built surface
+    3: 2,    # impervious surface   -> built surface
+    4: 2,    # swimming_pool        -> built surface
+    5: 0,    # bare_soil            -> other
+    6: 4,    # water
+    7: 0,    # snow                 -> other
+    8: 5,    # coniferous           -> vegetation
+    9: 5,    # deciduous            -> vegetation
+    10: 5,   # brushwood            -> vegetation
+    11: 6,   # vineyard             -> agriculture
+    12: 3,   # herbaceous vegetation
+    13: 6,   # agricultural land    -> agriculture
+    14: 6,   # plowed land          -> agriculture
+    15: 6,   # greenhouse           -> agriculture
+}
+
+# Mapbox static image cache
+MAPBOX_BBOX_TOLERANCE = 1e-4     # degrees (~10 m): closer views share a capture
+MAPBOX_CACHE_MAX_BYTES = 128 * 1024 * 1024
+MAPBOX_CACHE_DISK_MAX_BYTES = 1024 ** 3
+MAPBOX_CACHE_TTL = 30 * 24 * 3600
+
+# High-resolution mosaic capture
+MOSAIC_TILE_PIXELS = 512         # side of each static image in the grid
+MOSAIC_MAX_TILES = 64
+MOSAIC_WORKERS = 6
+MOSAIC_RESOLUTIONS = [0.5, 1.0, 2.0, 5.0, 10.0]   # m / pixel choices
+
+# Mask format asked to the backend: "index" (palette PNG / run-length class
+# ids, colorized locally) or "rgb". Backends ignoring it answer in RGB, which
+# is still decoded.
+MASK_FORMAT = os.getenv("CARTE_MASK_FORMAT", "index")
+
+# Upload encoding: "auto" sends uploads as they are when the backend reads
+# their format, and falls back to a fast PNG otherwise. Other choices:
+# "png", "png-fast", "webp" (lossless) and "npy" (raw array + shape header).
+UPLOAD_ENCODER = os.getenv("CARTE_UPLOAD_ENCODER", "auto")
+UPLOAD_PASSTHROUGH_FORMATS = ("PNG", "JPEG")
+
+# Per-session image store: bytes kept in memory per session and for the whole
+# process; least recently used images are spilled to disk beyond that.
+SESSION_MEMORY_BUDGET = int(os.getenv("CARTE_SESSION_MEMORY_MB", "96")) * 1024 * 1024
+GLOBAL_MEMORY_BUDGET = int(os.getenv("CARTE_GLOBAL_MEMORY_MB", "1024")) * 1024 * 1024
+SESSION_MAX_IMAGES = 16          # images per session, spilled or not
+SESSION_SPILL_DIR = f"{CACHE_DIR}/sessions"
+
+# Background segmentation jobs (shared by every session of the process)
+JOB_WORKERS = 8                  # jobs running at once
+JOB_HISTORY = 64                 # finished jobs kept for their results
+JOB_TTL = 30 * 60                # seconds a finished job stays available
+JOB_POLL_INTERVAL = 0.5          # seconds between status refreshes in the pages
+SPECULATIVE_MAX_JOBS = 2         # unfinished jobs per session before speculation pauses
+
+# Headless batch segmentation (batch_segment.py)
+BATCH_WORKERS = 8                # images in flight at once
+BATCH_RETRIES = 3                # extra attempts per image on transient errors
+BATCH_BACKOFF = 2.0              # seconds before the first retry, doubled after
+
+# Latency metrics: per-stage timings of captures and predictions
+METRICS_DIR = f"{CACHE_DIR}/metrics"
+METRICS_RECENT = 200             # finished traces kept for the sidebar panels
+METRICS_WINDOW = 1000            # samples per endpoint / stage for percentiles
+METRICS_JSONL_MAX_BYTES = 10 * 1024 * 1024   # traces.jsonl rolls over past this
+
+# Model health checks: models a page needs are pinged to keep Cloud Run warm
+HEALTH_INTERVAL = 60             # seconds between pings of a model in use
+HEALTH_KEEPALIVE = 15 * 60       # models stay warm this long after a page needed them
+HEALTH_TIMEOUT = (5, 90)         # (connect, read): a ping may have to wait for a cold start
+HEALTH_WORKERS = 4               # pings in flight at once
+COLD_START_IDLE = 15 * 60        # Cloud Run scales a service to zero after ~15 idle min
+
+# IoU evaluation against ground-truth masks (evaluate.py and the pages)
+EVAL_DATASET_DIR = os.getenv("CARTE_EVAL_DIR", "data/eval")   # image / mask pairs scored in the pages
+EVAL_TRUTH_CLASS_DATA = FLAIR_CLASS_DATA   # class map of the ground-truth masks
+EVAL_WORKERS = 8                 # images in flight at once
+EVAL_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# Georeferenced export of predictions (GeoTIFF / PNG + world file / GeoJSON)
+EXPORT_DIR = f"{CACHE_DIR}/exports"
+EXPORT_TILE = 256                # GeoTIFF tile side: tiles are written one at a time
+EXPORT_MIN_PIXELS = 16           # polygons (and holes) smaller than this are dropped
@@ -0,0 +1,70 @@
+# utils/encoding.py
+import time
+from collections import namedtuple
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from utils.constants import UPLOAD_ENCODER, UPLOAD_PASSTHROUGH_FORMATS
+
+# What is actually sent: bytes, multipart file name / type, and its cost
+Payload = namedtuple("Payload", ["data", "filename", "mime", "encoder", "seconds"])
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def _pil_encoder(fmt, **options):
+    def encode(image):
+        buffer = BytesIO()
+        image.save(buffer, format=fmt, **options)
+        return buffer.getvalue()
+    return encode
+
+
+def _encode_npy(image):
+    """Raw .npy: a small header with dtype and shape, then the pixels as-is."""
+    buffer = BytesIO()
+    np.save(buffer, np.asarray(image), allow_pickle=False)
+    return buffer.getvalue()
+
+
+# name -> (encode function, file name, mime type)
+ENCODERS = {
+    "png": (_pil_encoder("PNG"), "input.png", "image/png"),
+    "png-fast": (_pil_encoder("PNG", compress_level=1), "input.png", "image/png"),
+    "webp": (_pil_encoder("WEBP", lossless=True, method=0), "input.webp", "image/webp"),
+    "npy": (_encode_npy, "input.npy", "application/octet-stream"),
+}
+
+
+def passthrough_format(data):
+    """Format of already-encoded bytes if the backend reads it, else None."""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            fmt, mode = image.format, image.mode
+    except Exception:
+        return None
+    # Only plain RGB files decode to the very pixels the cache key was built on
+    return fmt if fmt in UPLOAD_PASSTHROUGH_FORMATS and mode == "RGB" else None
+
+
+def encode_image(image, original=None, encoder=UPLOAD_ENCODER):
+    """Build the upload payload for ``image``.
+
+    With ``encoder="auto"``, ``original`` (the bytes the image was decoded
+    from) is sent unchanged when its format is accepted, so nothing gets
+    re-compressed; otherwise the image goes out as a fast, low-compression
+    PNG. Any key of ``ENCODERS`` forces that encoding.
+    """
+    start = time.perf_counter()
+    if encoder == "auto":
+        fmt = passthrough_format(original) if original is not None else None
+        if fmt is not None:
+            filename = f"input.{'jpg' if fmt == 'JPEG' else fmt.lower()}"
+            return Payload(original, filename, MIME_TYPES[fmt], "passthrough", time.perf_counter() - start)
+        encoder = "png-fast"
+
+    encode, filename, mime = ENCODERS[encoder]
+    data = encode(image)
+    return Payload(data, filename, mime, encoder, time.perf_counter() - start)
@@ -0,0 +1,249 @@
+# utils/evaluation.py
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from utils import http_client
+from utils.batch import find_images, predict_index
+from utils.cache import LRUCache, make_key
+from utils.change import class_mapping, remap, transition_matrix
+from utils.constants import (
+    CACHE_DIR,
+    EVAL_CACHE_MAX_BYTES,
+    EVAL_DATASET_DIR,
+    EVAL_TRUTH_CLASS_DATA,
+    EVAL_WORKERS,
+    TILE_OVERLAP,
+)
+from utils.jobs import JOBS
+from utils.labels import INDEX_MODES, UNKNOWN, class_names, index_mask, rgb_to_index
+from utils.models import EVAL_MODELS, MODELS
+from utils.segmentation import APIError
+
+# Reports of complete runs, keyed by dataset content hash + model
+EVALUATION_CACHE = LRUCache(
+    "evaluations",
+    max_bytes=EVAL_CACHE_MAX_BYTES,
+    disk_dir=f"{CACHE_DIR}/evaluations",
+)
+
+MASK_SUFFIXES = ("_mask", "_label", "_gt")   # "<image>_mask.png" next to "<image>.png"
+
+# id: relative name of the image in the dataset
+EvalPair = namedtuple("EvalPair", ["id", "image", "mask"])
+
+
+# -------------------- DATASET --------------------
+
+def find_pairs(root):
+    """Image / ground-truth mask pairs under ``root``.
+
+    Either ``images/`` and ``masks/`` sub-folders holding the same relative
+    names (extensions may differ), or masks next to their image and named
+    after it with one of ``MASK_SUFFIXES``. Images without a mask are left out.
+    """
+    images_dir, masks_dir = os.path.join(root, "images"), os.path.join(root, "masks")
+    if os.path.isdir(images_dir) and os.path.isdir(masks_dir):
+        masks = {os.path.splitext(item.id)[0]: item.path for item in find_images(masks_dir)}
+        return [
+            EvalPair(item.id, item.path, masks[os.path.splitext(item.id)[0]])
+            for item in find_images(images_dir)
+            if os.path.splitext(item.id)[0] in masks
+        ]
+
+    items = {os.path.splitext(item.id)[0]: item for item in find_images(root)}
+    pairs = []
+    for stem, item in items.items():
+        if stem.endswith(MASK_SUFFIXES):
+            continue
+        for suffix in MASK_SUFFIXES:
+            mask = items.get(stem + suffix)
+            if mask is not None:
+                pairs.append(EvalPair(item.id, item.path, mask.path))
+                break
+    return pairs
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, size, mtime):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_digest(path):
+    """Content hash of a file, computed again only when it changes on disk."""
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def dataset_digest(pairs):
+    """Content hash of a dataset: same files, same hash (names and order aside)."""
+    h = hashlib.sha256()
+    for image, mask in sorted((file_digest(pair.image), file_digest(pair.mask)) for pair in pairs):
+        h.update(f"{image}:{mask}\n".encode())
+    return h.hexdigest()
+
+
+# -------------------- GROUND TRUTH --------------------
+
+def read_truth(source, class_data=EVAL_TRUTH_CLASS_DATA):
+    """(H, W) uint8 class ids of a ground-truth mask (path or file object).
+
+    Greyscale images and class-palette ones hold class ids; 16 / 32-bit ones
+    too (values out of range become UNKNOWN). Colorized masks (RGB or other
+    palettes) are matched against the ``class_data`` colors exactly:
+    off-palette pixels are UNKNOWN.
+    """
+    with Image.open(source) as mask:
+        if mask.mode in INDEX_MODES:
+            return index_mask(mask, class_data, snap=False)
+        if mask.mode.startswith("I") or mask.mode == "F":
+            values = np.asarray(mask)
+            return np.where((values >= 0) & (values < UNKNOWN), values, UNKNOWN).astype(np.uint8)
+        return rgb_to_index(np.asarray(mask.convert("RGB")), class_data, snap=False)
+
+
+# -------------------- SCORES --------------------
+
+def iou_scores(matrix):
+    """Per-class IoU, mean IoU and pixel accuracy of a confusion matrix.
+
+    ``matrix[i, j]`` counts pixels of true class ``i`` predicted as ``j``.
+    Classes absent from both truth and prediction get NaN and are left out
+    of the mean.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    intersection = np.diag(matrix)
+    union = matrix.sum(axis=0) + matrix.sum(axis=1) - intersection
+    with np.errstate(invalid="ignore", divide="ignore"):
+        iou = intersection / union
+    total = matrix.sum()
+    mean_iou = float(np.nanmean(iou)) if np.isfinite(iou).any() else None
+    accuracy = float(intersection.sum() / total) if total else None
+    return iou, mean_iou, accuracy
+
+
+def _report(matrix, class_data, **extra):
+    iou, mean_iou, accuracy = iou_scores(matrix)
+    return {
+        **extra,
+        "pixels": int(matrix.sum()),
+        "mean_iou": mean_iou,
+        "pixel_accuracy": accuracy,
+        "classes": {
+            name: None if np.isnan(value) else float(value)
+            for name, value in zip(class_names(class_data), iou)
+        },
+        "matrix": matrix.tolist(),
+    }
+
+
+def evaluate_mask(predicted, truth, class_data, truth_class_data=EVAL_TRUTH_CLASS_DATA):
+    """IoU report of one predicted class-index mask against its ground truth."""
+    mapping = class_mapping(truth_class_data, class_data)
+    if mapping:
+        truth = remap(truth, mapping)
+    n_classes = len(class_names(class_data))
+    return _report(transition_matrix(truth, predicted, n_classes), class_data, images=1)
+
+
+def score_pair(pair, model, truth_class_data=EVAL_TRUTH_CLASS_DATA, tile_size=0, overlap=TILE_OVERLAP):
+    """Confusion matrix (truth x prediction) of one pair; the masks are not kept."""
+    truth = read_truth(pair.mask, truth_class_data)
+    mapping = class_mapping(truth_class_data, model.class_data)
+    if mapping:
+        truth = remap(truth, mapping)
+    predicted, _ = predict_index(pair.image, model, tile_size, overlap)
+    if predicted.shape != truth.shape:
+        raise ValueError(f"Mask is {truth.shape[1]}x{truth.shape[0]}, image {predicted.shape[1]}x{predicted.shape[0]}")
+    return transition_matrix(truth, predicted, len(class_names(model.class_data)))
+
+
+# -------------------- RUN --------------------
+
+def evaluate(pairs, model, truth_class_data=EVAL_TRUTH_CLASS_DATA, max_workers=EVAL_WORKERS,
+             progress=None, tile_size=0, overlap=TILE_OVERLAP):
+    """IoU report of ``model`` over a dataset of ``pairs``.
+
+    Predictions run concurrently (at most ``2 * max_workers`` images
+    queued) and each image only adds its confusion matrix to the total, so
+    memory does not grow with the dataset. Pairs that fail are listed in
+    ``failed``. Reports of runs without failures are cached on the dataset
+    content hash and the model, and returned as they are next time.
+    """
+    dataset = dataset_digest(pairs)
+    key = make_key(dataset, model.endpoint, json.dumps(truth_class_data), str(tile_size), str(overlap))
+    cached = EVALUATION_CACHE.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    n_classes = len(class_names(model.class_data))
+    matrix = np.zeros((n_classes, n_classes), dtype=np.int64)
+    failed = []
+    done = 0
+    start = time.perf_counter()
+    todo = iter(pairs)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        try:
+            while True:
+                for pair in todo:
+                    future = pool.submit(score_pair, pair, model, truth_class_data, tile_size, overlap)
+                    pending[future] = pair
+                    if len(pending) >= 2 * max_workers:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pair = pending.pop(future)
+                    try:
+                        matrix += future.result()
+                    except (APIError, http_client.RequestException, OSError, ValueError) as e:
+                        failed.append({"id": pair.id, "error": str(e)[:500]})
+                    done += 1
+                    if progress:
+                        progress(done, len(pairs))
+        finally:
+            for future in pending:
+                future.cancel()
+
+    report = _report(
+        matrix, model.class_data,
+        model=model.name, dataset=dataset, images=len(pairs) - len(failed),
+        failed=failed, seconds=round(time.perf_counter() - start, 3),
+    )
+    if not failed:
+        EVALUATION_CACHE.set(key, json.dumps(report).encode())
+    return report
+
+
+def evaluate_models(pairs, keys=None, **options):
+    """IoU report of the page models (or those in ``keys``), one model at a time."""
+    for key in keys or EVAL_MODELS:
+        yield key, evaluate(pairs, MODELS[key], **options)
+
+
+def evaluation_job(model, root=EVAL_DATASET_DIR):
+    """Background IoU evaluation of ``model`` on the dataset under ``root`` (None without one).
+
+    Scans and hashes the dataset: meant to run once per page run, not on
+    every refresh. The dataset hash is part of the job key, so a changed
+    dataset starts a new run instead of serving the previous report.
+    """
+    pairs = find_pairs(root) if os.path.isdir(root) else []
+    if not pairs:
+        return None
+    dataset = dataset_digest(pairs)
+    # No owner: every session shares the run, and its report is cached per dataset hash
+    return JOBS.submit(evaluate, pairs, model, key=f"evaluate:{model.endpoint}:{dataset}")
@@ -0,0 +1,213 @@
+# utils/export.py
+import json
+import math
+import os
+
+import numpy as np
+
+from utils.batch import save_mask
+from utils.constants import EXPORT_MIN_PIXELS, EXPORT_TILE
+from utils.labels import class_counts, class_names, palette, rgb_to_index
+from utils.mapbox import EARTH_RADIUS
+from utils.vectorize import trace
+
+try:
+    import tifffile
+except ImportError:  # optional: without it only PNG + world file exports are written
+    tifffile = None
+
+# EPSG:3857 as ArcGIS / QGIS read it from a .prj next to the raster
+WEB_MERCATOR_WKT = (
+    'PROJCS["WGS_1984_Web_Mercator_Auxiliary_Sphere",GEOGCS["GCS_WGS_1984",'
+    'DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+    'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+    'PROJECTION["Mercator_Auxiliary_Sphere"],PARAMETER["False_Easting",0.0],'
+    'PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],'
+    'PARAMETER["Standard_Parallel_1",0.0],PARAMETER["Auxiliary_Sphere_Type",0.0],'
+    'UNIT["Meter",1.0]]'
+)
+
+# GeoTIFF keys: projected model, pixels are areas, EPSG:3857
+GEO_KEYS = (1, 1, 0, 3, 1024, 0, 1, 1, 1025, 0, 1, 1, 3072, 0, 1, 3857)
+BIGTIFF_BYTES = 2**32 - 2**25   # classic TIFF offsets stop at 4 GB (with room for the tags)
+COORDINATE_DECIMALS = 7         # ~1 cm in GeoJSON, as RFC 7946 suggests
+
+
+def pixel_size(shape, bounds):
+    """(width, height) in Web-Mercator meters of one pixel of a ``shape`` mask."""
+    xmin, ymin, xmax, ymax = bounds
+    return (xmax - xmin) / shape[1], (ymax - ymin) / shape[0]
+
+
+def world_file(shape, bounds):
+    """World file lines (A, D, B, E, C, F): affine transform of the pixel centers."""
+    xmin, _, _, ymax = bounds
+    width, height = pixel_size(shape, bounds)
+    return [width, 0.0, 0.0, -height, xmin + width / 2, ymax - height / 2]
+
+
+def _replace(path, write):
+    """Write ``path`` through ``write(tmp_path)``: readers never see half a file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_text(path, text):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            f.write(text)
+    _replace(path, write)
+
+
+# -------------------- RASTERS --------------------
+
+def _tiles(index, tile):
+    """Full ``tile`` x ``tile`` blocks of ``index``, row by row (edge tiles zero-padded)."""
+    height, width = index.shape
+    for top in range(0, height, tile):
+        for left in range(0, width, tile):
+            block = np.asarray(index[top:top + tile, left:left + tile])
+            if block.shape != (tile, tile):
+                padded = np.zeros((tile, tile), dtype=np.uint8)
+                padded[:block.shape[0], :block.shape[1]] = block
+                block = padded
+            yield block
+
+
+def write_geotiff(path, index, bounds, class_data, tile=EXPORT_TILE):
+    """Class-index mask as a tiled, compressed GeoTIFF in Web-Mercator (EPSG:3857).
+
+    Pixel values are class ids, shown in class colors (palette). Tiles are
+    read from ``index`` (which may be a memory map) and compressed one at a
+    time, so the file is streamed to disk whatever the mask size.
+    """
+    if tifffile is None:
+        raise RuntimeError("GeoTIFF export needs the tifffile package")
+    xmin, _, _, ymax = bounds
+    width, height = pixel_size(index.shape, bounds)
+    colormap = np.zeros((3, 256), dtype=np.uint16)
+    colors = palette(class_data).astype(np.uint16) * 257   # 8 to 16 bits
+    colormap[:, :len(colors)] = colors.T
+    _replace(path, lambda tmp_path: tifffile.imwrite(
+        tmp_path, _tiles(index, tile), shape=index.shape, dtype=np.uint8,
+        tile=(tile, tile), photometric="palette", colormap=colormap, compression="zlib",
+        bigtiff=index.size >= BIGTIFF_BYTES,
+        extratags=[
+            (33550, "d", 3, (width, height, 0.0), True),             # ModelPixelScale
+            (33922, "d", 6, (0.0, 0.0, 0.0, xmin, ymax, 0.0), True),  # ModelTiepoint
+            (34735, "H", len(GEO_KEYS), GEO_KEYS, True),             # GeoKeyDirectory
+        ],
+    ))
+
+
+def write_png_world(path, index, bounds, class_data):
+    """Class-index mask as a palette PNG, with its world file (.pgw) and projection (.prj)."""
+    save_mask(index, class_data, path)
+    stem = os.path.splitext(path)[0]
+    _write_text(f"{stem}.pgw", "".join(f"{value!r}\n" for value in world_file(index.shape, bounds)))
+    _write_text(f"{stem}.prj", WEB_MERCATOR_WKT)
+
+
+# -------------------- POLYGONS --------------------
+
+def _lonlat(points, shape, bounds):
+    """Pixel corners (y up from the bottom) in rounded WGS 84 lon / lat pairs."""
+    xmin, ymin, _, _ = bounds
+    width, height = pixel_size(shape, bounds)
+    lon = np.degrees((xmin + points[:, 0] * width) / EARTH_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp((ymin + points[:, 1] * height) / EARTH_RADIUS)) - math.pi / 2)
+    return np.round(np.column_stack([lon, lat]), COORDINATE_DECIMALS).tolist()
+
+
+def class_features(index, class_data, bounds, min_pixels=EXPORT_MIN_PIXELS):
+    """One GeoJSON MultiPolygon feature per class present in ``index``.
+
+    Outlines follow the pixel edges, which are parallels and meridians in
+    Web-Mercator, so the lon / lat polygons cover the exact same pixels.
+    """
+    names = class_names(class_data)
+    colors = palette(class_data)
+    counts = class_counts(index, len(names))
+    for class_id in np.flatnonzero(counts):
+        points, offsets, owners = trace(index == class_id, min_pixels)
+        if not owners.size:
+            continue
+        # All corners of the class converted at once, then cut into rings
+        corners = _lonlat(points, index.shape, bounds)
+        parts = []
+        for i, owner in enumerate(owners.tolist()):
+            if not i or owner != owners[i - 1]:
+                parts.append([])
+            parts[-1].append(corners[offsets[i]:offsets[i + 1]])
+        yield {
+            "type": "Feature",
+            "properties": {
+                "class": int(class_id),
+                "name": names[class_id],
+                "color": "#%02x%02x%02x" % tuple(colors[class_id]),
+                "pixels": int(counts[class_id]),
+            },
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": parts,
+            },
+        }
+
+
+def write_geojson(path, index, bounds, class_data, min_pixels=EXPORT_MIN_PIXELS):
+    """Polygons of every class as a GeoJSON FeatureCollection (WGS 84, RFC 7946).
+
+    Features are written as soon as each class is vectorized.
+    """
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            f.write('{"type": "FeatureCollection", "features": [\n')
+            for i, feature in enumerate(class_features(index, class_data, bounds, min_pixels)):
+                f.write(",\n" if i else "")
+                # dumps, not dump: the C encoder only serves whole strings
+                f.write(json.dumps(feature, separators=(",", ":")))
+            f.write("\n]}\n")
+    _replace(path, write)
+
+
+# -------------------- EXPORT --------------------
+
+EXPORT_FORMATS = ("GeoTIFF", "PNG + world file", "GeoJSON")
+
+
+def export_prediction(index, class_data, bounds, directory, name="prediction",
+                      formats=("GeoTIFF", "GeoJSON"), min_pixels=EXPORT_MIN_PIXELS):
+    """Write a georeferenced class-index mask in ``formats``; returns the paths written.
+
+    ``bounds`` is the Web-Mercator (xmin, ymin, xmax, ymax) extent of the
+    mask, as returned by ``fetch_mosaic`` or ``static_bbox_bounds``.
+    """
+    paths = []
+    for fmt in formats:
+        path = os.path.join(directory, name)
+        if fmt == "GeoTIFF":
+            write_geotiff(f"{path}.tif", index, bounds, class_data)
+            paths.append(f"{path}.tif")
+        elif fmt == "PNG + world file":
+            write_png_world(f"{path}.png", index, bounds, class_data)
+            paths += [f"{path}.png", f"{path}.pgw", f"{path}.prj"]
+        elif fmt == "GeoJSON":
+            write_geojson(f"{path}.geojson", index, bounds, class_data, min_pixels)
+            paths.append(f"{path}.geojson")
+        else:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of {EXPORT_FORMATS}")
+    return paths
+
+
+def export_label(label_image, class_data, bounds, directory, name="prediction",
+                 formats=("GeoTIFF", "GeoJSON"), min_pixels=EXPORT_MIN_PIXELS):
+    """``export_prediction`` of a colored label image, as returned by ``segment``."""
+    index = rgb_to_index(np.asarray(label_image), class_data)
+    return export_prediction(index, class_data, bounds, directory, name, formats, min_pixels)
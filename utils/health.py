@@ -0,0 +1,162 @@
+# utils/health.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import http_client
+from utils.constants import (
+    HEALTH_INTERVAL,
+    HEALTH_KEEPALIVE,
+    HEALTH_TIMEOUT,
+    HEALTH_WORKERS,
+    COLD_START_IDLE,
+)
+from utils.models import MODELS, health_url
+
+UNKNOWN = "unknown"
+WARMING = "warming"
+READY = "ready"
+DOWN = "down"
+
+
+class Probe:
+    """What the pings of one health URL tell (models on one service share it)."""
+
+    def __init__(self, url):
+        self.url = url
+        self.status = UNKNOWN
+        self.pending = False
+        self.checked = None       # time of the last answer or failure
+        self.last_ok = None       # time of the last successful ping
+        self.latency = None       # seconds taken by the last successful ping
+        self.cold_start = None    # seconds taken by the last ping after an idle period
+        self.cold_starts = 0
+        self.failures = 0
+        self.error = None
+
+    def record(self, ok, seconds, error=None, now=None):
+        now = now or time.time()
+        if ok:
+            # Nothing answered for a while: Cloud Run had to start an instance
+            if self.last_ok is None or now - self.last_ok > COLD_START_IDLE:
+                self.cold_start = seconds
+                self.cold_starts += 1
+            self.status = READY
+            self.last_ok = now
+            self.latency = seconds
+            self.error = None
+        else:
+            self.status = DOWN
+            self.failures += 1
+            self.error = error
+        self.checked = now
+        self.pending = False
+
+
+class HealthMonitor:
+    """Background pinger keeping the models pages need warm, and their readiness.
+
+    ``watch`` is called when a page opens: its models are pinged at once
+    (unless checked recently), then every ``interval`` seconds for as long
+    as some page asked for them within ``keepalive`` seconds. The thread
+    stops by itself once no model is wanted any more.
+    """
+
+    def __init__(self, interval=HEALTH_INTERVAL, keepalive=HEALTH_KEEPALIVE,
+                 timeout=HEALTH_TIMEOUT, max_workers=HEALTH_WORKERS):
+        self.interval = interval
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="health")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._wanted = {}   # model key -> last time a page needed it
+        self._probes = {}   # health url -> Probe
+
+    # -------------------- public API --------------------
+
+    def watch(self, *keys):
+        """Ping the models ``keys`` now and keep them warm while pages use them."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._wanted[key] = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="health-monitor", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def status(self, key):
+        """Readiness of model ``key``: UNKNOWN, WARMING, READY or DOWN."""
+        with self._lock:
+            probe = self._probes.get(health_url(MODELS[key]))
+            return probe.status if probe else UNKNOWN
+
+    def statuses(self, keys=None):
+        """One row per model (the watched ones by default)."""
+        with self._lock:
+            rows = []
+            for key in keys or list(self._wanted):
+                spec = MODELS[key]
+                probe = self._probes.get(health_url(spec)) or Probe(health_url(spec))
+                rows.append({
+                    "model": spec.name,
+                    "status": probe.status,
+                    "latency": probe.latency,
+                    "cold_start": probe.cold_start,
+                    "cold_starts": probe.cold_starts,
+                    "failures": probe.failures,
+                    "checked": probe.checked,
+                    "error": probe.error,
+                })
+            return rows
+
+    # -------------------- internals --------------------
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval / 4)
+            self._wake.clear()
+            with self._lock:
+                due = self._due(time.time())
+                if due is None:
+                    self._thread = None
+                    return
+            for probe in due:
+                self._pool.submit(self._ping, probe)
+
+    def _due(self, now):
+        """Probes to ping now (called with the lock held); None when nothing is wanted."""
+        urls = {
+            health_url(MODELS[key]) for key, wanted in self._wanted.items()
+            if now - wanted <= self.keepalive
+        }
+        if not urls:
+            return None
+        due = []
+        for url in urls:
+            probe = self._probes.setdefault(url, Probe(url))
+            if probe.pending or (probe.checked is not None and now - probe.checked < self.interval):
+                continue
+            probe.pending = True
+            if probe.status != READY:
+                probe.status = WARMING
+            due.append(probe)
+        return due
+
+    def _ping(self, probe):
+        start = time.perf_counter()
+        try:
+            # A single attempt: the next round is the retry
+            response = http_client.get(probe.url, timeout=self.timeout, idempotent=False)
+            ok, error = response.status_code < 500, f"HTTP {response.status_code}"
+        except http_client.RequestException as e:
+            ok, error = False, str(e)[:200]
+        seconds = time.perf_counter() - start
+        with self._lock:
+            probe.record(ok, seconds, None if ok else error)
+
+
+# One monitor per process: every session shares the pings
+MONITOR = HealthMonitor()
@@ -0,0 +1,70 @@
+# utils/http_client.py
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.constants import (
+    HTTP_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF,
+    HTTP_POOL_SIZE,
+    HTTP_MAX_CONCURRENCY_PER_HOST,
+)
+
+# Re-exported so callers don't need to import requests themselves
+RequestException = requests.exceptions.RequestException
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_pools = {}  # "scheme://host" -> (session, semaphore)
+
+
+def _pool(url):
+    """Pooled keep-alive session + concurrency limiter for the host of ``url``."""
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _lock:
+        if host not in _pools:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount(host, adapter)
+            _pools[host] = (session, threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY_PER_HOST))
+        return _pools[host]
+
+
+def request(method, url, timeout=HTTP_TIMEOUT, idempotent=None, **kwargs):
+    """Send a request through the shared pool of ``url``'s host.
+
+    Idempotent calls (GET... or ``idempotent=True``) are retried with
+    exponential backoff on connection errors, timeouts and 429/5xx answers.
+    """
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    attempts = 1 + HTTP_MAX_RETRIES if idempotent else 1
+    session, slots = _pool(url)
+
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            with slots:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if last_attempt:
+                raise
+        else:
+            if last_attempt or response.status_code not in RETRY_STATUSES:
+                return response
+        time.sleep(HTTP_BACKOFF * 2 ** attempt)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
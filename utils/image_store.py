@@ -0,0 +1,363 @@
+# utils/image_store.py
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from utils.constants import (
+    SESSION_MEMORY_BUDGET,
+    GLOBAL_MEMORY_BUDGET,
+    SESSION_MAX_IMAGES,
+    SESSION_SPILL_DIR,
+)
+from utils.encoding import ENCODERS
+from utils.segmentation import image_digest
+
+# Every live store of the process, for the global budget and memory reports
+_STORES = weakref.WeakSet()
+_STORES_LOCK = threading.Lock()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class StoredImage:
+    """An image kept encoded, shared by every page of a session.
+
+    The encoded bytes are the reference copy (and are uploaded as they
+    are). The RGB PIL image and the read-only NumPy array built from them
+    are caches the owning store may drop, and the bytes themselves may be
+    spilled to disk; both come back transparently on the next access.
+    ``bounds`` is the Web-Mercator extent of map captures (None for uploads).
+    """
+
+    def __init__(self, data, name=None, bounds=None):
+        self._data = data
+        self._path = None
+        self.name = name
+        self.bounds = bounds
+        self.digest = hashlib.sha256(data).hexdigest()
+        self._size = None
+        self._array = None
+        self._image = None
+        self._pixel_digest = None
+
+    @classmethod
+    def from_image(cls, image, name=None, bounds=None):
+        """StoredImage of an already decoded image (kept as a fast PNG)."""
+        image = image.convert("RGB") if image.mode != "RGB" else image
+        stored = cls(ENCODERS["png-fast"][0](image), name, bounds)
+        stored._image = image
+        stored._size = image.size
+        return stored
+
+    @property
+    def data(self):
+        """Encoded bytes, read back from disk if they were spilled."""
+        data = self._data
+        if data is None:
+            with open(self._path, "rb") as f:
+                data = f.read()
+        return data
+
+    @property
+    def format(self):
+        """Encoding of ``data`` ("PNG", "JPEG"...) read from the header only."""
+        return Image.open(BytesIO(self.data)).format
+
+    @property
+    def image(self):
+        """RGB PIL image, decoded on first use after a release."""
+        image = self._image
+        if image is None:
+            with Image.open(BytesIO(self.data)) as decoded:
+                image = decoded.convert("RGB")
+            self._image = image
+        return image
+
+    @property
+    def array(self):
+        """Read-only (H, W, 3) uint8 array, built on first use after a release."""
+        array = self._array
+        if array is None:
+            array = np.asarray(self.image)
+            array.flags.writeable = False
+            self._array = array
+        return array
+
+    @property
+    def size(self):
+        """(width, height), from the header when the image isn't decoded."""
+        if self._size is None:
+            self._size = Image.open(BytesIO(self.data)).size
+        return self._size
+
+    @property
+    def shape(self):
+        width, height = self.size
+        return (height, width, 3)
+
+    @property
+    def pixel_digest(self):
+        """Hash used by the prediction cache, computed once."""
+        if self._pixel_digest is None:
+            self._pixel_digest = image_digest(self.image)
+        return self._pixel_digest
+
+    @property
+    def spill_name(self):
+        """File name of the spilled bytes: the content hash, plus the location of captures.
+
+        Same pixels captured at two places are two images, each with its own file.
+        """
+        if self.bounds is None:
+            return f"{self.digest}.bin"
+        return f"{hashlib.sha256(f'{self.digest}:{self.bounds}'.encode()).hexdigest()}.bin"
+
+    @property
+    def spilled(self):
+        return self._data is None
+
+    @property
+    def encoded_bytes(self):
+        return len(self._data) if self._data is not None else os.path.getsize(self._path)
+
+    @property
+    def decoded_bytes(self):
+        """Memory held by the decoded image and array."""
+        width, height = self.size
+        image = width * height * 3 if self._image is not None else 0
+        return image + (self._array.nbytes if self._array is not None else 0)
+
+    @property
+    def nbytes(self):
+        """Memory held by this image: in-memory bytes plus decoded copies."""
+        return (len(self._data) if self._data is not None else 0) + self.decoded_bytes
+
+    def release(self):
+        """Drop the decoded copies; returns the number of bytes freed."""
+        freed = self.decoded_bytes
+        self._image = None
+        self._array = None
+        return freed
+
+    def spill(self, path):
+        """Move the encoded bytes to ``path``; returns the number of bytes freed.
+
+        The file lives as long as this image: evicted images may still be
+        held by the page or a queued job, and read back from it.
+        """
+        data = self._data
+        if data is None:
+            return 0
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        weakref.finalize(self, _remove, path)
+        self._path = path
+        self._data = None
+        return len(data)
+
+
+class ImageStore:
+    """Per-session images, keyed by upload id (or capture key) and by content hash.
+
+    Re-uploading the same content under another id hands back the image
+    already stored. Memory is bounded by ``max_bytes``: past it, the decoded
+    copies of the least recently used images are dropped first, then their
+    encoded bytes are spilled to ``spill_dir``. The most recently used image
+    always stays decoded. Only the ``max_items`` most recent are kept at all,
+    and every store also answers to a process-wide budget (``trim_all``).
+    """
+
+    def __init__(self, max_bytes=SESSION_MEMORY_BUDGET, max_items=SESSION_MAX_IMAGES, spill_dir=SESSION_SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.spill_dir = os.path.join(spill_dir, uuid.uuid4().hex) if spill_dir else None
+        self.last_used = time.time()
+        self.releases = 0
+        self.spills = 0
+        self.evictions = 0
+        self.traced = None            # tracemalloc sizes of the previous report
+        self._reserved = 0            # images kept past max_items by add_uploads, during the call
+
+        self._lock = threading.RLock()
+        self._by_id = OrderedDict()   # file id -> StoredImage
+        # (content hash, bounds) -> StoredImage, while alive: one image (and spill file) per content
+        self._by_digest = weakref.WeakValueDictionary()
+
+        if self.spill_dir:
+            # Spilled files go away with the session
+            weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+        with _STORES_LOCK:
+            _STORES.add(self)
+
+    # -------------------- public API --------------------
+
+    def get(self, file_id):
+        with self._lock:
+            self.last_used = time.time()
+            stored = self._by_id.get(file_id)
+            if stored is not None:
+                self._by_id.move_to_end(file_id)
+            return stored
+
+    def add_bytes(self, file_id, data, name=None):
+        stored = self.get(file_id)
+        if stored is not None:
+            return stored
+        # Uploads have no location: a capture with the same bytes is another image
+        return self._add(file_id, StoredImage(data, name))
+
+    def add_image(self, key, image, name=None, bounds=None):
+        """StoredImage of a decoded image (e.g. a map capture, located by ``bounds``) under ``key``."""
+        stored = self.get(key)
+        if stored is not None:
+            return stored
+        # Same pixels elsewhere on the map (e.g. open sea) are not the same capture
+        return self._add(key, StoredImage.from_image(image, name, bounds))
+
+    def add_upload(self, uploaded):
+        """StoredImage of a Streamlit ``UploadedFile`` (read only the first time)."""
+        stored = self.get(uploaded.file_id)
+        if stored is None:
+            stored = self.add_bytes(uploaded.file_id, uploaded.getvalue(), uploaded.name)
+        return stored
+
+    def add_uploads(self, uploaded_files):
+        """StoredImages of several uploads, none evicting another even past ``max_items``.
+
+        The extra room lasts for this call only: the next addition trims the
+        store back to ``max_items``.
+        """
+        self._reserved = len(uploaded_files)
+        try:
+            return [self.add_upload(uploaded) for uploaded in uploaded_files]
+        finally:
+            self._reserved = 0
+
+    def nbytes(self):
+        with self._lock:
+            return sum(stored.nbytes for stored in self._images())
+
+    def trim(self, max_bytes):
+        """Release, then spill, least recently used images until ``max_bytes`` fit."""
+        with self._lock:
+            older = self._images()[:-1]
+            resident = sum(stored.nbytes for stored in self._images())
+            # Decoded copies first: they are rebuilt from the bytes on demand
+            for stored in older:
+                if resident <= max_bytes:
+                    return
+                freed = stored.release()
+                if freed:
+                    resident -= freed
+                    self.releases += 1
+            for stored in older:
+                if resident <= max_bytes:
+                    return
+                resident -= self._spill(stored)
+
+    def stats(self):
+        with self._lock:
+            images = self._images()
+            return {
+                "images": len(images),
+                "bytes": sum(stored.nbytes for stored in images),
+                "decoded_bytes": sum(stored.decoded_bytes for stored in images),
+                "spilled": sum(stored.spilled for stored in images),
+                "spilled_bytes": sum(stored.encoded_bytes for stored in images if stored.spilled),
+                "budget": self.max_bytes,
+                "releases": self.releases,
+                "spills": self.spills,
+                "evictions": self.evictions,
+            }
+
+    def describe(self):
+        """One row per image, least recently used first."""
+        with self._lock:
+            return [
+                {
+                    "name": stored.name,
+                    "shape": stored.shape,
+                    "encoded_bytes": stored.encoded_bytes,
+                    "memory_bytes": stored.nbytes,
+                    "decoded": stored._image is not None,
+                    "spilled": stored.spilled,
+                }
+                for stored in self._images()
+            ]
+
+    # -------------------- internals --------------------
+
+    def _images(self):
+        """Distinct images, least recently used first."""
+        return list(dict.fromkeys(reversed(self._by_id.values())))[::-1]
+
+    def _add(self, file_id, stored):
+        """Store ``stored`` under ``file_id``, or the live image of same content and bounds."""
+        with self._lock:
+            stored = self._by_digest.setdefault((stored.digest, stored.bounds), stored)
+            self._by_id[file_id] = stored
+            while len(self._by_id) > max(self.max_items, self._reserved):
+                _, evicted = self._by_id.popitem(last=False)
+                self._forget(evicted)
+            self.trim(self.max_bytes)
+        trim_all()
+        return stored
+
+    def _forget(self, stored):
+        # Still reachable from the page or a job: only the decoded copies go now
+        if stored not in self._by_id.values():
+            stored.release()
+            self.evictions += 1
+
+    def _spill(self, stored):
+        """Spill ``stored`` to disk, or evict it when that isn't possible."""
+        if stored.spilled:
+            return 0
+        if self.spill_dir:
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                freed = stored.spill(os.path.join(self.spill_dir, stored.spill_name))
+                self.spills += 1
+                return freed
+            except OSError:
+                pass
+        freed = stored.nbytes
+        for file_id in [k for k, v in self._by_id.items() if v is stored]:
+            del self._by_id[file_id]
+        self._forget(stored)
+        return freed
+
+
+def stores():
+    """Live stores of the process, least recently active first."""
+    with _STORES_LOCK:
+        return sorted(_STORES, key=lambda store: store.last_used)
+
+
+def trim_all(max_bytes=GLOBAL_MEMORY_BUDGET):
+    """Trim the least recently active sessions until the process fits ``max_bytes``."""
+    live = stores()
+    total = sum(store.nbytes() for store in live)
+    for store in live:
+        if total <= max_bytes:
+            break
+        before = store.nbytes()
+        store.trim(0)
+        total -= before - store.nbytes()
@@ -0,0 +1,159 @@
+# utils/jobs.py
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils import metrics
+from utils.constants import JOB_WORKERS, JOB_HISTORY, JOB_TTL
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """One unit of work submitted to a ``JobQueue``.
+
+    ``key`` identifies the input (same key, same work) and ``owner`` the
+    session that asked for it. ``progress`` is the last ``(done, total)``
+    reported by the work function, if it reports any.
+    """
+
+    def __init__(self, key=None, owner=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.owner = owner
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.progress = None
+
+    @property
+    def status(self):
+        if self.cancelled:
+            return CANCELLED
+        if self.future.done():
+            return FAILED if self.future.exception() is not None else DONE
+        return RUNNING if self.started else PENDING
+
+    def done(self):
+        return self.cancelled or self.future.done()
+
+    @property
+    def result(self):
+        return self.future.result() if self.status == DONE else None
+
+    @property
+    def error(self):
+        return self.future.exception() if self.status == FAILED else None
+
+    @property
+    def elapsed(self):
+        """Seconds since submission (until the end, once finished)."""
+        return (self.finished or time.time()) - self.submitted
+
+    def wait(self, timeout=None):
+        """Block until the job is over or ``timeout`` seconds passed."""
+        if not self.cancelled:
+            wait([self.future], timeout)
+        return self.done()
+
+    def set_progress(self, done, total):
+        self.progress = (done, total)
+
+
+class JobQueue:
+    """Bounded worker pool running jobs off the Streamlit script thread.
+
+    Jobs live in the process, not in a session: a page keeps only the job
+    id, so a result is still there after a rerun or a page change. Finished
+    jobs are dropped after ``ttl`` seconds, or beyond ``max_jobs``.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_jobs=JOB_HISTORY, ttl=JOB_TTL):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}   # job id -> Job, in submission order
+
+    def submit(self, fn, *args, key=None, owner=None, progress=False, limit=None, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` and return its Job.
+
+        A live or successful job of the same ``owner`` and ``key`` is
+        returned instead of starting the work again. With ``progress``,
+        ``fn`` also gets a ``progress(done, total)`` callback. With
+        ``limit``, nothing is queued (None is returned) while ``owner``
+        already has that many jobs queued or running, cancelled ones included.
+        """
+        with self._lock:
+            self._prune()
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and job.owner == owner and job.status not in (FAILED, CANCELLED):
+                        return job
+            if limit is not None:
+                # Cancelled jobs still calling the backend count too: only the future knows
+                active = sum(1 for job in self._jobs.values() if job.owner == owner and not job.future.done())
+                if active >= limit:
+                    return None
+            job = Job(key, owner)
+            if progress:
+                kwargs["progress"] = job.set_progress
+            # Run in the submitter's context, so an active metrics trace follows the job
+            job.future = self._pool.submit(metrics.bind(self._run), job, fn, args, kwargs)
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job: queued ones never run, running ones have their result ignored."""
+        job = self.get(job_id)
+        if job is not None and not job.done():
+            job.cancelled = True
+            job.future.cancel()
+            job.finished = time.time()
+        return job
+
+    def cancel_owner(self, owner, keep_key=None):
+        """Cancel every unfinished job of ``owner`` whose key isn't ``keep_key``."""
+        for job in self.jobs(owner):
+            if job.key != keep_key:
+                self.cancel(job.id)
+
+    def jobs(self, owner=None, active=True):
+        """Jobs of ``owner`` (all owners if None), only unfinished ones by default."""
+        with self._lock:
+            return [
+                job for job in self._jobs.values()
+                if (owner is None or job.owner == owner) and not (active and job.done())
+            ]
+
+    def _run(self, job, fn, args, kwargs):
+        job.started = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        # Called with the lock held. Cancelled jobs still running are kept, for ``limit``
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.future.done()]
+        expired = {job.id for job in finished if now - (job.finished or job.submitted) > self.ttl}
+        excess = max(0, len(self._jobs) - len(expired) - self.max_jobs)
+        expired.update([job.id for job in finished if job.id not in expired][:excess])
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# One queue per process: the pool bounds the backend calls of all sessions
+JOBS = JobQueue()
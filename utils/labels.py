@@ -0,0 +1,183 @@
+# utils/labels.py
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+UNKNOWN = 255            # class index of pixels matching no palette color
+CHUNK_PIXELS = 1 << 22   # pixels decoded per block, bounds temporary memory
+
+
+def hex_to_rgb(color):
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def palette(class_data):
+    """(n_classes, 3) uint8 array of class colors, row ``i`` = class ``i``."""
+    n_classes = max(class_data) + 1
+    colors = np.zeros((n_classes, 3), dtype=np.uint8)
+    for class_id, (_, color) in class_data.items():
+        colors[class_id] = hex_to_rgb(color)
+    return colors
+
+
+def class_names(class_data):
+    return [class_data[i][0] if i in class_data else str(i) for i in range(max(class_data) + 1)]
+
+
+def _pack(rgb):
+    """24-bit color codes of an (..., 3) uint8 array."""
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+@lru_cache(maxsize=8)
+def _color_lut(colors, snap):
+    """Dense code -> class index table (16 MB), one per palette and mode.
+
+    Snapping tables start as a copy of the exact one and learn the nearest
+    class of every off-palette color the first time it is seen.
+    """
+    lut = np.full(1 << 24, UNKNOWN, dtype=np.uint8)
+    codes = _pack(np.array(colors, dtype=np.uint8))
+    # Reversed so that the lowest class id wins for duplicated colors
+    lut[codes[::-1]] = np.arange(len(colors), dtype=np.uint8)[::-1]
+    return lut
+
+
+def _snap(lut, unknown, colors):
+    """Assign the ``unknown`` color codes to their nearest palette color."""
+    colors = colors.astype(np.int32)
+    for start in range(0, unknown.size, 1 << 16):
+        block = unknown[start:start + (1 << 16)]
+        rgb = np.stack([(block >> 16) & 255, (block >> 8) & 255, block & 255], axis=-1).astype(np.int32)
+        distances = ((rgb[:, None, :] - colors[None, :, :]) ** 2).sum(-1)
+        lut[block] = distances.argmin(axis=1).astype(np.uint8)
+
+
+def rgb_to_index(rgb, class_data, snap=True):
+    """Turn an RGB(A) label image into a (H, W) uint8 class-index array.
+
+    Exact palette colors go through a precomputed lookup table. With
+    ``snap`` the slightly-off colors produced by lossy encodings or resizing
+    are mapped to the nearest class color; otherwise they get ``UNKNOWN``.
+    """
+    rgb = np.asarray(rgb)[..., :3]
+    height, width = rgb.shape[:2]
+    colors = palette(class_data)
+    lut = _color_lut(tuple(map(tuple, colors.tolist())), snap)
+
+    index = np.empty((height, width), dtype=np.uint8)
+    rows = max(1, CHUNK_PIXELS // max(width, 1))
+    for top in range(0, height, rows):
+        codes = _pack(rgb[top:top + rows])
+        block = lut[codes]
+        if snap:
+            missing = block == UNKNOWN
+            if missing.any():
+                _snap(lut, np.unique(codes[missing]), colors)
+                block[missing] = lut[codes[missing]]
+        index[top:top + rows] = block
+    return index
+
+
+def class_counts(index, n_classes):
+    """Pixel count per class in a single ``bincount`` pass (UNKNOWN dropped)."""
+    counts = np.bincount(index.ravel(), minlength=max(n_classes, UNKNOWN + 1))
+    return counts[:n_classes]
+
+
+def class_percentages(index, class_data, exclude=()):
+    """Percentage of the image covered by every class, keyed by class name.
+
+    Classes listed in ``exclude`` (names) are left out of the total, e.g.
+    no-data borders.
+    """
+    names = class_names(class_data)
+    counts = class_counts(index, len(names))
+    keep = np.array([name not in exclude for name in names])
+    total = counts[keep].sum()
+    percentages = 100.0 * counts / total if total else np.zeros(len(names))
+    return {name: float(p) for name, p, k in zip(names, percentages, keep) if k}
+
+
+def group_percentages(percentages, groups):
+    """Sum class percentages into named groups.
+
+    ``groups`` maps a group name to class names; classes absent from the
+    class map at hand are ignored, so one definition serves every map.
+    """
+    return {
+        group: sum(percentages.get(name, 0.0) for name in members)
+        for group, members in groups.items()
+    }
+
+
+# -------------------- COMPACT MASK TRANSPORT --------------------
+
+RLE_MAGIC = b"RLE1"
+RLE_RUN = np.dtype([("value", "u1"), ("length", "<u4")])
+INDEX_MODES = ("P", "L")   # PNG modes carrying class ids instead of colors
+
+
+def encode_rle(index):
+    """Run-length encode a class-index mask: magic, <u4 height/width, runs."""
+    flat = np.ascontiguousarray(index, dtype=np.uint8).reshape(-1)
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    runs = np.empty(starts.size, dtype=RLE_RUN)
+    runs["value"] = flat[starts]
+    runs["length"] = np.diff(np.append(starts, flat.size))
+    header = RLE_MAGIC + np.array(index.shape[:2], dtype="<u4").tobytes()
+    return header + runs.tobytes()
+
+
+def decode_rle(content):
+    height, width = np.frombuffer(content, dtype="<u4", count=2, offset=len(RLE_MAGIC))
+    runs = np.frombuffer(content, dtype=RLE_RUN, offset=len(RLE_MAGIC) + 8)
+    return np.repeat(runs["value"], runs["length"]).reshape(int(height), int(width))
+
+
+def index_mask(mask, class_data, snap=True):
+    """Class ids of a palette / greyscale PIL ``mask``.
+
+    Greyscale values, and palette indices under the class palette (or a
+    grey ramp), are class ids as they are. Any other palette is a colorized
+    mask: its colors are matched against the class colors, each palette
+    entry once.
+    """
+    values = np.array(mask)
+    if mask.mode != "P":
+        return values
+    colors = np.array(mask.getpalette() or [], dtype=np.uint8).reshape(-1, 3)
+    class_colors = palette(class_data)
+    n = min(len(colors), len(class_colors))
+    ramp = np.repeat(np.arange(len(colors), dtype=np.uint8)[:, None], 3, axis=1)
+    if np.array_equal(colors[:n], class_colors[:n]) or np.array_equal(colors, ramp):
+        return values
+    table = np.full(256, UNKNOWN, dtype=np.uint8)
+    table[:len(colors)] = rgb_to_index(colors[None], class_data, snap)[0]
+    return table[values]
+
+
+def decode_mask(content, class_data, snap=True):
+    """Class-index array out of any mask the backend may answer with.
+
+    Accepts run-length encoded masks, palette / greyscale PNGs whose pixel
+    values are class ids, colorized palette PNGs and colorized RGB PNGs.
+    """
+    if content.startswith(RLE_MAGIC):
+        return decode_rle(content)
+    with Image.open(BytesIO(content)) as mask:
+        if mask.mode in INDEX_MODES:
+            return index_mask(mask, class_data, snap)
+        return rgb_to_index(np.asarray(mask.convert("RGB")), class_data, snap)
+
+
+def colorize(index, class_data):
+    """(H, W, 3) RGB rendering of a class-index mask (UNKNOWN drawn black)."""
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    class_colors = palette(class_data)
+    colors[:len(class_colors)] = class_colors
+    return colors[index]
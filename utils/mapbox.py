@@ -0,0 +1,187 @@
+# utils/mapbox.py
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from PIL import Image
+
+from utils import http_client, metrics
+from utils.cache import LRUCache, make_key
+from utils.constants import (
+    CACHE_DIR,
+    MAPBOX_STYLE,
+    MAPBOX_TIMEOUT,
+    MAPBOX_BBOX_TOLERANCE,
+    MAPBOX_CACHE_MAX_BYTES,
+    MAPBOX_CACHE_DISK_MAX_BYTES,
+    MAPBOX_CACHE_TTL,
+    MOSAIC_TILE_PIXELS,
+    MOSAIC_MAX_TILES,
+    MOSAIC_WORKERS,
+)
+
+STATIC_API_URL = "https://api.mapbox.com/styles/v1/{style}/static/{view}/{width}x{height}"
+
+# Shared by every page and session: repeat captures never hit the network
+STATIC_CACHE = LRUCache(
+    "mapbox-static",
+    max_bytes=MAPBOX_CACHE_MAX_BYTES,
+    ttl=MAPBOX_CACHE_TTL,
+    disk_dir=f"{CACHE_DIR}/mapbox",
+    disk_max_bytes=MAPBOX_CACHE_DISK_MAX_BYTES,
+)
+
+
+def quantize(value, tolerance=MAPBOX_BBOX_TOLERANCE):
+    """Snap a coordinate on a ``tolerance`` grid, formatted for URLs / keys."""
+    steps = round(value / tolerance)
+    return f"{steps * tolerance:.6f}".rstrip("0").rstrip(".")
+
+
+def bbox_from_bounds(bounds):
+    """(west, south, east, north) out of the ``bounds`` returned by st_folium."""
+    return (
+        bounds["_southWest"]["lng"],
+        bounds["_southWest"]["lat"],
+        bounds["_northEast"]["lng"],
+        bounds["_northEast"]["lat"],
+    )
+
+
+def bbox_string(bbox, tolerance=MAPBOX_BBOX_TOLERANCE):
+    return ",".join(quantize(v, tolerance) for v in bbox)
+
+
+def _fetch(view, width, height, token, style, params=""):
+    """Static image for a URL ``view`` segment, through the capture cache."""
+    key = make_key(style, view, f"{width}x{height}", params)
+    content = STATIC_CACHE.get(key)
+
+    if content is None:
+        url = STATIC_API_URL.format(style=style, view=view, width=width, height=height)
+        with metrics.stage("mapbox"):
+            response = http_client.get(f"{url}?access_token={token}{params}", timeout=MAPBOX_TIMEOUT)
+            response.raise_for_status()
+        content = response.content
+        STATIC_CACHE.set(key, content)
+
+    return Image.open(BytesIO(content)).convert("RGB")
+
+
+def fetch_static_bbox(bbox, token, width=512, height=512, padding=0.1, style=MAPBOX_STYLE):
+    """Static image of a (west, south, east, north) bbox.
+
+    The bbox is quantized before the request, so every view within the
+    tolerance maps to the same cached capture.
+    """
+    return _fetch(f"[{bbox_string(bbox)}]", width, height, token, style, f"&padding={padding}")
+
+
+def fetch_static_view(lon, lat, zoom, token, width=512, height=512, style=MAPBOX_STYLE):
+    """Static image centered on ``lon, lat`` at ``zoom``."""
+    view = f"{quantize(lon)},{quantize(lat)},{zoom},0,0"
+    return _fetch(view, width, height, token, style)
+
+
+# -------------------- MOSAIC CAPTURE --------------------
+
+EARTH_RADIUS = 6378137.0                           # Web-Mercator sphere, m
+MERCATOR_EXTENT = math.pi * EARTH_RADIUS           # half the world width, m
+STATIC_TILE_SIZE = 512                             # Mapbox static zoom 0 width
+
+
+def lonlat_to_mercator(lon, lat):
+    x = math.radians(lon) * EARTH_RADIUS
+    y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def mercator_to_lonlat(x, y):
+    lon = math.degrees(x / EARTH_RADIUS)
+    lat = math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS)) - math.pi / 2)
+    return lon, lat
+
+
+def static_bbox_bounds(bbox, width=512, height=512, padding=0.1):
+    """Web-Mercator (xmin, ymin, xmax, ymax) extent of a ``fetch_static_bbox`` image.
+
+    Mapbox centers the (quantized) bbox and zooms until it fits inside the
+    image less ``padding`` pixels per side, so the image covers more than
+    the bbox along one axis.
+    """
+    west, south, east, north = (float(v) for v in bbox_string(bbox).split(","))
+    xmin, ymin = lonlat_to_mercator(west, south)
+    xmax, ymax = lonlat_to_mercator(east, north)
+    pixel = max((xmax - xmin) / (width - 2 * padding), (ymax - ymin) / (height - 2 * padding))
+    # Static images stop at zoom 22
+    pixel = max(pixel, 2 * MERCATOR_EXTENT / (STATIC_TILE_SIZE * 2 ** 22))
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    half_w, half_h = width * pixel / 2, height * pixel / 2
+    return cx - half_w, cy - half_h, cx + half_w, cy + half_h
+
+
+def mosaic_grid(bbox, resolution, tile_pixels=MOSAIC_TILE_PIXELS):
+    """Plan the static captures covering ``bbox`` at ``resolution`` m/pixel.
+
+    ``resolution`` is measured on the ground at the bbox center latitude.
+    Returns ``(zoom, columns, rows, bounds)`` where ``bounds`` is the
+    (xmin, ymin, xmax, ymax) Web-Mercator extent actually covered by the
+    grid (the bbox grown to a whole number of tiles).
+    """
+    west, south, east, north = bbox
+    xmin, ymin = lonlat_to_mercator(west, south)
+    xmax, ymax = lonlat_to_mercator(east, north)
+    # Mercator meters are stretched by 1 / cos(lat) compared to the ground
+    center_lat = math.radians((south + north) / 2)
+    zoom = math.log2(2 * MERCATOR_EXTENT * math.cos(center_lat) / (STATIC_TILE_SIZE * resolution))
+    # Zoom goes into URLs with 2 decimals: derive the pixel size back from it
+    zoom = round(min(max(zoom, 0.0), 22.0), 2)
+    mercator_resolution = 2 * MERCATOR_EXTENT / (STATIC_TILE_SIZE * 2 ** zoom)
+
+    tile_span = tile_pixels * mercator_resolution
+    columns = max(1, math.ceil((xmax - xmin) / tile_span))
+    rows = max(1, math.ceil((ymax - ymin) / tile_span))
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    half_w, half_h = columns * tile_span / 2, rows * tile_span / 2
+    return zoom, columns, rows, (cx - half_w, cy - half_h, cx + half_w, cy + half_h)
+
+
+def fetch_mosaic(bbox, token, resolution, tile_pixels=MOSAIC_TILE_PIXELS,
+                 max_tiles=MOSAIC_MAX_TILES, max_workers=MOSAIC_WORKERS,
+                 progress=None, style=MAPBOX_STYLE):
+    """Capture ``bbox`` at ``resolution`` m/pixel as one seamless image.
+
+    The bbox is split into a grid of ``tile_pixels`` static images, each
+    requested by center and fractional zoom so neighbours share exact edges.
+    They are fetched concurrently (through the capture cache) and pasted
+    into one mosaic. Returns ``(image, bounds)`` with ``bounds`` the
+    Web-Mercator (xmin, ymin, xmax, ymax) extent of the image, i.e. its
+    georeference. ``progress(done, total)`` is called from the calling
+    thread after every tile.
+    """
+    zoom, columns, rows, bounds = mosaic_grid(bbox, resolution, tile_pixels)
+    if columns * rows > max_tiles:
+        raise ValueError(
+            f"{columns}x{rows} tiles needed at {resolution} m/pixel "
+            f"(max {max_tiles}): pick a coarser resolution or a smaller area"
+        )
+
+    xmin, _, _, ymax = bounds
+    tile_span = (bounds[2] - xmin) / columns
+    mosaic = Image.new("RGB", (columns * tile_pixels, rows * tile_pixels))
+
+    def fetch(column, row):
+        lon, lat = mercator_to_lonlat(xmin + (column + 0.5) * tile_span, ymax - (row + 0.5) * tile_span)
+        view = f"{lon:.7f},{lat:.7f},{zoom:.2f},0,0"
+        return _fetch(view, tile_pixels, tile_pixels, token, style, "&attribution=false&logo=false")
+
+    cells = [(column, row) for row in range(rows) for column in range(columns)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(metrics.bind(fetch), column, row): (column, row) for column, row in cells}
+        for done, future in enumerate(as_completed(futures), start=1):
+            column, row = futures[future]
+            mosaic.paste(future.result(), (column * tile_pixels, row * tile_pixels))
+            if progress is not None:
+                progress(done, len(cells))
+
+    return mosaic, bounds
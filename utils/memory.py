@@ -0,0 +1,61 @@
+# utils/memory.py
+import tracemalloc
+
+from utils.constants import GLOBAL_MEMORY_BUDGET
+from utils.image_store import stores
+
+TRACE_FRAMES = 1
+
+
+def start_tracing():
+    """Turn tracemalloc on for the process (it slows allocations down a bit)."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+
+
+def process_usage():
+    live = stores()
+    return {
+        "sessions": len(live),
+        "bytes": sum(store.nbytes() for store in live),
+        "budget": GLOBAL_MEMORY_BUDGET,
+    }
+
+
+def _traced_sizes():
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    return {str(stat.traceback[0]): stat.size for stat in snapshot.statistics("lineno")}
+
+
+def memory_report(store, top=10):
+    """Memory used by one session, next to the whole process.
+
+    ``session`` / ``images`` come from the store's own accounting (exact,
+    including pixel buffers allocated by Pillow, which tracemalloc does not
+    see). When tracing is on, ``traced`` adds the Python-level allocations
+    of the process, with the ``top`` allocation sites and how much each grew
+    since this session's previous report.
+    """
+    report = {
+        "session": store.stats(),
+        "images": store.describe(),
+        "process": process_usage(),
+        "traced": None,
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        sizes = _traced_sizes()
+        previous, store.traced = store.traced, sizes
+        sites = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:top]
+        report["traced"] = {
+            "current": current,
+            "peak": peak,
+            "top": [
+                {"where": where, "bytes": size, "growth": size - previous.get(where, 0) if previous else None}
+                for where, size in sites
+            ],
+        }
+    return report
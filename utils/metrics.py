@@ -0,0 +1,197 @@
+# utils/metrics.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import partial
+
+import numpy as np
+
+from utils.constants import METRICS_DIR, METRICS_RECENT, METRICS_WINDOW, METRICS_JSONL_MAX_BYTES
+
+QUANTILES = (50, 95, 99)
+
+log = logging.getLogger(__name__)
+
+_current = ContextVar("trace", default=None)
+_lock = threading.Lock()
+_recent = deque(maxlen=METRICS_RECENT)                        # finished traces
+_samples = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))  # (endpoint, stage) -> seconds
+_totals = defaultdict(lambda: [0, 0.0])                       # (endpoint, stage) -> [count, sum]
+
+
+class Trace:
+    """Timings of one user action (a capture, a prediction...) by stage.
+
+    Stages run concurrently (e.g. tiles) add up, so their sum may exceed the
+    wall-clock ``total``.
+    """
+
+    def __init__(self, label, endpoint=None, owner=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.endpoint = endpoint
+        self.owner = owner
+        self.started = time.time()
+        self.total = None
+        self.stages = {}   # name -> seconds, in first-seen order
+        self._start = time.perf_counter()
+
+    @property
+    def finished(self):
+        return self.total is not None
+
+    def add(self, name, seconds):
+        with _lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        _sample(self.endpoint, name, seconds)
+
+    def finish(self):
+        """Close the trace (once) and export it."""
+        with _lock:
+            if self.total is not None:
+                return
+            self.total = time.perf_counter() - self._start
+            _recent.append(self)
+        _sample(self.endpoint, "total", self.total)
+        _export(self)
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "label": self.label,
+            "endpoint": self.endpoint,
+            "started": self.started,
+            "total": self.total,
+            "stages": dict(self.stages),
+        }
+
+
+def _sample(endpoint, name, seconds):
+    key = (endpoint or "", name)
+    with _lock:
+        _samples[key].append(seconds)
+        _totals[key][0] += 1
+        _totals[key][1] += seconds
+
+
+# -------------------- instrumentation --------------------
+
+def start_trace(label, endpoint=None, owner=None):
+    """Open a trace to be finished later (e.g. once its result is rendered)."""
+    return Trace(label, endpoint, owner)
+
+
+@contextmanager
+def activate(trace):
+    """Make ``trace`` the one ``stage`` records into, in this context."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def trace(label, endpoint=None, owner=None):
+    """Time a whole action: ``with trace("capture"): ...``"""
+    current = Trace(label, endpoint, owner)
+    with activate(current):
+        try:
+            yield current
+        finally:
+            current.finish()
+
+
+@contextmanager
+def stage(name):
+    """Time one stage of the current trace (a no-op outside any trace)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = _current.get()
+        if current is not None and not current.finished:
+            current.add(name, time.perf_counter() - start)
+
+
+def bind(fn):
+    """``fn`` running in a copy of the current context, for thread pools:
+    stages timed in worker threads land in the submitting trace."""
+    return partial(copy_context().run, fn)
+
+
+# -------------------- reading --------------------
+
+def recent(owner=None, limit=None):
+    """Finished traces, newest first, optionally of one owner (session)."""
+    with _lock:
+        traces = [t for t in reversed(_recent) if owner is None or t.owner == owner]
+    return traces[:limit] if limit else traces
+
+
+def _quantiles(samples):
+    """``summary`` of a {(endpoint, stage): seconds array} snapshot."""
+    result = defaultdict(dict)
+    for (endpoint, name), values in sorted(samples.items()):
+        stats = {"count": int(values.size)}
+        for q, value in zip(QUANTILES, np.percentile(values, QUANTILES)):
+            stats[f"p{q}"] = float(value)
+        result[endpoint][name] = stats
+    return dict(result)
+
+
+def summary():
+    """{endpoint: {stage: {"count", "p50", "p95", "p99"}}} over the recent window."""
+    with _lock:
+        samples = {key: np.array(values) for key, values in _samples.items() if values}
+    return _quantiles(samples)
+
+
+def prometheus_text():
+    """Prometheus exposition format: a summary per endpoint and stage."""
+    lines = [
+        "# HELP carte_stage_seconds Time spent per pipeline stage.",
+        "# TYPE carte_stage_seconds summary",
+    ]
+    # One snapshot of both: a stage sampled in between would have no total
+    with _lock:
+        samples = {key: np.array(values) for key, values in _samples.items() if values}
+        totals = {key: tuple(value) for key, value in _totals.items()}
+    for endpoint, stages in _quantiles(samples).items():
+        for name, stats in stages.items():
+            labels = f'endpoint="{endpoint}",stage="{name}"'
+            for q in QUANTILES:
+                lines.append(f'carte_stage_seconds{{{labels},quantile="{q / 100}"}} {stats[f"p{q}"]:.6f}')
+            count, total = totals[(endpoint, name)]
+            lines.append(f"carte_stage_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"carte_stage_seconds_count{{{labels}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------- export --------------------
+
+def _export(finished, directory=METRICS_DIR):
+    """Append the trace to the rolling traces.jsonl and refresh the Prometheus
+    textfile (for node_exporter's textfile collector)."""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "traces.jsonl")
+        with _lock:
+            if os.path.exists(path) and os.path.getsize(path) > METRICS_JSONL_MAX_BYTES:
+                os.replace(path, f"{path}.1")
+            with open(path, "a") as f:
+                f.write(json.dumps(finished.as_dict()) + "\n")
+        prom_path = os.path.join(directory, "carte.prom")
+        tmp_path = f"{prom_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, prom_path)
+    except Exception:
+        # Metrics must never break a prediction
+        log.exception("Could not export metrics to %s", directory)
@@ -0,0 +1,63 @@
+# utils/models.py
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from utils.constants import (
+    API_ENDPOINT_INITIAL,
+    API_ENDPOINT_LATEST,
+    API_ENDPOINT_MODEL_1,
+    API_ENDPOINT_MODEL_2,
+    API_ENDPOINT_COMPARE,
+    API_ENDPOINT_EVOLUTION,
+    API_ENDPOINT_GET,
+    HTTP_TIMEOUT,
+    TILE_SIZE,
+    FLAIR_CLASS_DATA,
+    REDUCED_7,
+)
+
+# input_size: side in pixels of the patches the model was trained on
+# ground_resolution: meters per pixel of its training imagery (FLAIR: 0.2 m)
+# timeout: (connect, read) seconds of a prediction call
+# health_url: pinged by the health monitor (defaults to the root of the endpoint's host)
+ModelSpec = namedtuple(
+    "ModelSpec",
+    ["name", "endpoint", "class_data", "input_size", "ground_resolution", "timeout", "health_url"],
+    defaults=(HTTP_TIMEOUT, None),
+)
+
+MODELS = {
+    # Streamlit pages
+    "initial": ModelSpec("Initial model", API_ENDPOINT_INITIAL, FLAIR_CLASS_DATA, 512, 0.2),
+    "latest": ModelSpec("Fine-tuned model", API_ENDPOINT_LATEST, REDUCED_7, 512, 0.2),
+    # Pitch app, one per mode
+    "unet": ModelSpec("U-net", API_ENDPOINT_MODEL_1, FLAIR_CLASS_DATA, TILE_SIZE, 0.2, health_url=API_ENDPOINT_GET),
+    "unet_plus": ModelSpec("U-net +", API_ENDPOINT_MODEL_2, FLAIR_CLASS_DATA, TILE_SIZE, 0.2, health_url=API_ENDPOINT_GET),
+    "compare": ModelSpec("Compare", API_ENDPOINT_COMPARE, FLAIR_CLASS_DATA, TILE_SIZE, 0.2, health_url=API_ENDPOINT_GET),
+    "evolution": ModelSpec("Evolution", API_ENDPOINT_EVOLUTION, FLAIR_CLASS_DATA, TILE_SIZE, 0.2, health_url=API_ENDPOINT_GET),
+}
+
+# Scored by evaluate.py by default: the pitch models run on a local dev server
+EVAL_MODELS = ("initial", "latest")
+
+
+def model_for_endpoint(endpoint):
+    """Spec of the registered model served at ``endpoint`` (None if unknown)."""
+    for spec in MODELS.values():
+        if spec.endpoint == endpoint:
+            return spec
+    return None
+
+
+def endpoint_timeout(endpoint):
+    """Timeout of the model served at ``endpoint`` (the HTTP default if unknown)."""
+    spec = model_for_endpoint(endpoint)
+    return spec.timeout if spec else HTTP_TIMEOUT
+
+
+def health_url(spec):
+    """URL pinged to check (and wake up) the service behind ``spec``."""
+    if spec.health_url:
+        return spec.health_url
+    parts = urlsplit(spec.endpoint)
+    return f"{parts.scheme}://{parts.netloc}/"
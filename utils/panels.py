@@ -0,0 +1,194 @@
+# utils/panels.py
+# Panels shared by the apps and pages: the only utils module drawing with Streamlit
+import os
+
+import numpy as np
+import streamlit as st
+
+from utils import metrics
+from utils.constants import EXPORT_DIR, EXPORT_MIN_PIXELS, JOB_POLL_INTERVAL
+from utils.evaluation import evaluate_mask, read_truth
+from utils.export import EXPORT_FORMATS, export_label
+from utils.health import MONITOR
+from utils.jobs import JOBS
+from utils.labels import rgb_to_index
+from utils.memory import memory_report, start_tracing
+from utils.models import MODELS
+
+
+# -------------------- SIDEBAR --------------------
+
+
+def memory_panel(store):
+    """Memory held by this session's image ``store`` and by the whole process."""
+    with st.sidebar.expander("🧠 Memory"):
+        if st.toggle("Trace Python allocations (whole process)", key="trace_memory"):
+            start_tracing()
+        report = memory_report(store)
+        session, process = report["session"], report["process"]
+        st.metric(
+            "This session", f"{session['bytes'] / 2**20:.1f} MB",
+            help=f"Budget: {session['budget'] / 2**20:.0f} MB, older images are spilled to disk beyond it",
+        )
+        st.caption(
+            f"{session['images']} images, {session['spilled']} spilled · "
+            f"process: {process['sessions']} sessions, {process['bytes'] / 2**20:.0f} / {process['budget'] / 2**20:.0f} MB"
+        )
+        if report["images"]:
+            st.dataframe(report["images"], hide_index=True)
+        if report["traced"]:
+            traced = report["traced"]
+            st.caption(f"Traced: {traced['current'] / 2**20:.1f} MB (peak {traced['peak'] / 2**20:.1f} MB)")
+            st.dataframe(traced["top"], hide_index=True)
+
+
+def latency_panel(owner):
+    """Stage timings of the last actions of ``owner``, and of all sessions."""
+    with st.sidebar.expander("⏱️ Latency"):
+        traces = metrics.recent(owner=owner, limit=10)
+        if traces:
+            st.caption("Your last actions (ms per stage)")
+            st.dataframe(
+                [
+                    {"action": t.label, "total": round(t.total * 1000),
+                     **{name: round(seconds * 1000) for name, seconds in t.stages.items()}}
+                    for t in traces
+                ],
+                hide_index=True,
+            )
+        else:
+            st.caption("No timed action yet in this session.")
+        rows = [
+            {"endpoint": endpoint.rstrip("/").rsplit("/", 1)[-1] or "-", "stage": name, **stats}
+            for endpoint, stages in metrics.summary().items()
+            for name, stats in stages.items()
+        ]
+        if rows:
+            st.caption("All sessions, recent window (seconds)")
+            st.dataframe(rows, hide_index=True)
+
+
+def models_panel():
+    """Readiness of the models watched by the health monitor."""
+    with st.sidebar.expander("🩺 Models"):
+        st.dataframe(
+            [
+                {"model": row["model"], "status": row["status"],
+                 "ping (ms)": row["latency"] and round(row["latency"] * 1000),
+                 "cold start (s)": row["cold_start"] and round(row["cold_start"], 1),
+                 "failures": row["failures"]}
+                for row in MONITOR.statuses()
+            ],
+            hide_index=True,
+        )
+
+
+def render_sidebar_panels(memory=True, latency=True, models=True):
+    """Memory, latency and model health panels at the bottom of the sidebar."""
+    if memory:
+        memory_panel(st.session_state.image_store)
+    if latency:
+        latency_panel(st.session_state.session_id)
+    if models:
+        models_panel()
+
+
+# -------------------- RESULTS --------------------
+
+def job_status(job, message, unit="tiles"):
+    """Progress of a running ``job``, refreshed every ``JOB_POLL_INTERVAL`` without holding the page.
+
+    ``message(job)`` is shown while the job reports no progress. Once the
+    job ends the app reruns, so the caller draws its result.
+    """
+    @st.fragment(run_every=JOB_POLL_INTERVAL)
+    def refresh():
+        if job.done():
+            st.rerun()
+        if job.progress:
+            done, total = job.progress
+            st.progress(done / total, text=f"{done} / {total} {unit}")
+        else:
+            st.info(message(job))
+
+    refresh()
+
+
+def iou_panel(output_image, class_data, evaluation=None):
+    """Mean IoU of a label image against an uploaded ground truth, and of the model.
+
+    ``evaluation`` is the model's job from ``evaluation_job`` (None without
+    an evaluation set); this only reads its state.
+    """
+    truth_file = st.file_uploader(
+        "Ground-truth mask (optional)", type=["png", "tif", "tiff"], key="truth_uploader"
+    )
+    if truth_file is not None:
+        try:
+            report = evaluate_mask(
+                rgb_to_index(np.asarray(output_image), class_data), read_truth(truth_file), class_data
+            )
+        except (OSError, ValueError) as e:
+            st.warning(f"Could not score the prediction against this mask: {e}")
+        else:
+            if report["mean_iou"] is not None:
+                st.markdown(f"🥳 Mean IoU is {report['mean_iou']:.2f}")
+
+    if evaluation is None:
+        return
+    if not evaluation.done():
+        st.caption("📏 Scoring the model on the evaluation set...")
+    elif evaluation.result is not None and evaluation.result["mean_iou"] is not None:
+        report = evaluation.result
+        st.markdown(f"📏 Model mean IoU is {report['mean_iou']:.2f} ({report['images']} evaluation images)")
+        with st.expander("IoU per class"):
+            st.dataframe(
+                [{"class": name, "IoU": iou} for name, iou in report["classes"].items() if iou is not None],
+                hide_index=True,
+            )
+    elif evaluation.error is not None:
+        st.caption(f"📏 Evaluation failed: {evaluation.error}")
+
+
+def export_panel(stored, output_image, model_key, job_state):
+    """Downloads of a label image as georeferenced files, located by its map capture.
+
+    The files are written by a background job, whose id is kept in
+    ``st.session_state[job_state]``.
+    """
+    model = MODELS[model_key]
+    with st.expander("📦 Export (GIS)"):
+        formats = st.multiselect(
+            "Formats", EXPORT_FORMATS, default=["GeoTIFF", "GeoJSON"], key="export_formats",
+            help="Rasters in Web-Mercator (EPSG:3857), polygons per class in WGS 84",
+        )
+        min_pixels = st.number_input(
+            "Smallest polygon kept (pixels)", min_value=1, value=EXPORT_MIN_PIXELS, key="export_min_pixels"
+        )
+        key = f"export:{model.endpoint}:{stored.digest}:{stored.bounds}:{formats}:{min_pixels}"
+        job = JOBS.get(st.session_state[job_state])
+        if job is not None and job.key != key:
+            JOBS.cancel(job.id)
+            job = None
+
+        if st.button("Prepare files", key="export", disabled=not formats):
+            # Large mosaics take a while to write and vectorize: off the page thread
+            job = JOBS.submit(
+                export_label, output_image, model.class_data, stored.bounds,
+                os.path.join(EXPORT_DIR, stored.digest[:16]), model_key, tuple(formats), min_pixels,
+                key=key, owner=st.session_state.session_id,
+            )
+            st.session_state[job_state] = job.id
+        if job is None:
+            return
+        if not job.done():
+            job_status(job, lambda job: f"⏳ Writing the files... ({job.elapsed:.0f} s)")
+            return
+
+        if job.error is not None:
+            st.error(str(job.error))
+        for path in job.result or []:
+            with open(path, "rb") as f:
+                st.download_button(
+                    f"⬇️ {os.path.basename(path)}", f, file_name=os.path.basename(path), key=f"download:{path}"
+                )
@@ -0,0 +1,49 @@
+# utils/preprocessing.py
+from collections import namedtuple
+from io import BytesIO
+
+from PIL import Image
+
+# ``scale`` = prescaled size / original size, ``original_size`` = (w, h)
+Prescaled = namedtuple("Prescaled", ["image", "scale", "original_size"])
+
+
+def target_scale(size, model, ground_resolution=None):
+    """Resize factor bringing an image of ``size`` to what ``model`` expects.
+
+    With a known ``ground_resolution`` (m / pixel) the image is resampled
+    to the model's training resolution. Without one the image is left as
+    it is: shrinking it to the input size would change its scale silently.
+    Images are never upscaled.
+    """
+    if not ground_resolution:
+        return 1.0
+    return min(ground_resolution / model.ground_resolution, 1.0)
+
+
+def prescale(source, model, ground_resolution=None):
+    """Downsample an image on the client before it is sent to ``model``.
+
+    ``source`` is a decoded PIL image or still-encoded bytes. For JPEG bytes,
+    PIL's ``draft()`` decodes straight at a reduced DCT scale (1/2, 1/4 or
+    1/8), so the full-size image is never built just to be shrunk.
+    """
+    image = Image.open(BytesIO(source)) if isinstance(source, bytes) else source
+    scale = target_scale(image.size, model, ground_resolution)
+    original_size = image.size
+    if scale >= 1.0:
+        return Prescaled(image.convert("RGB"), 1.0, original_size)
+
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if image.format == "JPEG":
+        image.draft("RGB", size)
+    # reducing_gap: box-reduce by an integer factor first, then a cheap filter
+    resized = image.convert("RGB").resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return Prescaled(resized, scale, original_size)
+
+
+def restore(label, prescaled):
+    """Map a mask predicted on a prescaled image back to the original size."""
+    if prescaled.scale == 1.0 or label.size == prescaled.original_size:
+        return label
+    return label.resize(prescaled.original_size, Image.NEAREST)
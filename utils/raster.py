@@ -0,0 +1,209 @@
+# utils/raster.py
+import hashlib
+import os
+import shutil
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from utils.constants import CACHE_DIR
+
+try:
+    import tifffile
+except ImportError:  # optional: without it rasters are decoded in one go by PIL
+    tifffile = None
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+SEGMENT_CACHE_SIZE = 64      # decoded TIFF tiles / strips kept for overlapping reads
+THUMBNAIL_BAND_ROWS = 1024   # rows decoded at once when no overview exists
+MASK_SUFFIX = ".mask.npy"    # stitched mask memory-mapped next to a spooled raster
+
+
+def is_tiff(name):
+    return name.lower().endswith(TIFF_EXTENSIONS)
+
+
+def spool_upload(uploaded, directory=f"{CACHE_DIR}/uploads"):
+    """Copy an uploaded file to disk (once per file id) and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    suffix = os.path.splitext(uploaded.name)[1].lower()
+    name = hashlib.sha256(uploaded.file_id.encode()).hexdigest()[:32]
+    path = os.path.join(directory, f"{name}{suffix}")
+    if not os.path.exists(path):
+        uploaded.seek(0)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(uploaded, f, length=1 << 20)
+        os.replace(tmp_path, path)
+    return path
+
+
+def discard_upload(path):
+    """Delete a spooled upload and the stitched mask written next to it."""
+    for name in (path, f"{path}{MASK_SUFFIX}"):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def open_upload(path):
+    """Windowed reader of a spooled upload, whose files go away with the reader.
+
+    Close it and ``discard_upload`` when the upload is replaced; the files
+    of a session that just ends are deleted once its reader is collected.
+    """
+    reader = open_raster(path)
+    weakref.finalize(reader, discard_upload, path)
+    return reader
+
+
+def to_rgb8(array):
+    """(H, W, 3) uint8 view of a raster window, whatever its bands / depth."""
+    if array.ndim == 2:
+        array = array[..., None]
+    if array.shape[-1] == 1:
+        array = np.repeat(array, 3, axis=-1)
+    array = array[..., :3]
+    if array.dtype == np.uint16:
+        array = (array >> 8).astype(np.uint8)
+    elif array.dtype != np.uint8:
+        array = np.clip(array, 0, 255).astype(np.uint8)
+    return array
+
+
+class RasterReader:
+    """Window-by-window access to a large raster on disk.
+
+    Uncompressed contiguous TIFFs are memory-mapped; tiled or stripped
+    (possibly compressed) TIFFs are decoded one segment at a time, only for
+    the segments a window touches. Mimics the two PIL calls the tiling
+    engine uses (``size`` and ``crop``) so it can stand in for an image.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tif = tifffile.TiffFile(path)
+        self._page = self._tif.pages.first
+        self.height, self.width = self._page.imagelength, self._page.imagewidth
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()
+        self._memmap = None
+        if self._page.is_memmappable:
+            self._memmap = tifffile.memmap(path, page=0, mode="r")
+        elif self._page.planarconfig != 1:
+            self._tif.close()
+            raise ValueError("Only pixel-interleaved (contiguous) TIFFs can be read by window")
+
+        if self._page.is_tiled:
+            self._seg_h, self._seg_w = self._page.tilelength, self._page.tilewidth
+        else:
+            self._seg_h, self._seg_w = self._page.rowsperstrip or self.height, self.width
+        self._seg_cols = -(-self.width // self._seg_w)
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def close(self):
+        self._tif.close()
+
+    def _segment(self, index):
+        """Decoded (h, w, samples) tile / strip number ``index`` (LRU cached)."""
+        with self._lock:
+            if index in self._segments:
+                self._segments.move_to_end(index)
+                return self._segments[index]
+            fh = self._tif.filehandle
+            fh.seek(self._page.dataoffsets[index])
+            data = fh.read(self._page.databytecounts[index])
+            segment, _, shape = self._page.decode(data, index, jpegtables=self._page.jpegtables)
+            segment = segment.reshape(shape)[0]
+            self._segments[index] = segment
+            if len(self._segments) > SEGMENT_CACHE_SIZE:
+                self._segments.popitem(last=False)
+            return segment
+
+    def read(self, box):
+        """(h, w, 3) uint8 array of ``box``; areas outside the raster are black."""
+        left, top, right, bottom = box
+        out = np.zeros((bottom - top, right - left, 3), dtype=np.uint8)
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(right, self.width), min(bottom, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return out
+
+        if self._memmap is not None:
+            out[y0 - top:y1 - top, x0 - left:x1 - left] = to_rgb8(self._memmap[y0:y1, x0:x1])
+            return out
+
+        for row in range(y0 // self._seg_h, (y1 - 1) // self._seg_h + 1):
+            for col in range(x0 // self._seg_w, (x1 - 1) // self._seg_w + 1):
+                segment = self._segment(row * self._seg_cols + col)
+                sy, sx = row * self._seg_h, col * self._seg_w
+                ya, yb = max(y0, sy), min(y1, sy + segment.shape[0])
+                xa, xb = max(x0, sx), min(x1, sx + segment.shape[1])
+                out[ya - top:yb - top, xa - left:xb - left] = to_rgb8(
+                    segment[ya - sy:yb - sy, xa - sx:xb - sx]
+                )
+        return out
+
+    def crop(self, box):
+        return Image.fromarray(self.read(box))
+
+    def thumbnail(self, max_side):
+        """Small preview, read from the smallest fitting overview if any."""
+        levels = self._tif.series[0].levels
+        fitting = [level for level in levels[1:] if max(level.shape[:2]) >= max_side]
+        if fitting:
+            preview = Image.fromarray(to_rgb8(fitting[-1].asarray()))
+        else:
+            step = max(1, -(-max(self.width, self.height) // max_side))
+            if self._memmap is not None:
+                preview = Image.fromarray(to_rgb8(np.ascontiguousarray(self._memmap[::step, ::step])))
+            else:
+                # No overview: decode band by band, keeping every step-th pixel
+                rows = THUMBNAIL_BAND_ROWS - THUMBNAIL_BAND_ROWS % step
+                bands = [
+                    self.read((0, top, self.width, min(top + rows, self.height)))[::step, ::step]
+                    for top in range(0, self.height, rows)
+                ]
+                preview = Image.fromarray(np.concatenate(bands))
+        preview.thumbnail((max_side, max_side))
+        return preview
+
+
+class PILRasterReader:
+    """Fallback reader (no tifffile / not a TIFF): decodes the whole image."""
+
+    def __init__(self, path):
+        self.path = path
+        self._image = Image.open(path).convert("RGB")
+
+    @property
+    def size(self):
+        return self._image.size
+
+    def close(self):
+        self._image.close()
+
+    def crop(self, box):
+        return self._image.crop(box)
+
+    def thumbnail(self, max_side):
+        preview = self._image.copy()
+        preview.thumbnail((max_side, max_side))
+        return preview
+
+
+def open_raster(path):
+    """Windowed reader for ``path``, falling back to PIL when it can't be."""
+    if tifffile is not None and is_tiff(path):
+        try:
+            return RasterReader(path)
+        except (ValueError, NotImplementedError, tifffile.TiffFileError):
+            pass
+    return PILRasterReader(path)
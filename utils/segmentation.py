@@ -0,0 +1,179 @@
+# utils/segmentation.py
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from PIL import Image
+
+from utils import http_client, metrics
+from utils.cache import LRUCache, make_key
+from utils.constants import (
+    CACHE_DIR,
+    PREDICTION_CACHE_MAX_BYTES,
+    PREDICTION_CACHE_DISK_MAX_BYTES,
+    PREDICTION_CACHE_TTL,
+    SERIES_WORKERS,
+    MASK_FORMAT,
+    FLAIR_CLASS_DATA,
+)
+from utils.encoding import encode_image
+from utils.models import endpoint_timeout
+from utils.labels import RLE_MAGIC, INDEX_MODES, decode_mask, colorize
+
+# One cache per process: identical tiles sent by any user / page are reused
+PREDICTION_CACHE = LRUCache(
+    "predictions",
+    max_bytes=PREDICTION_CACHE_MAX_BYTES,
+    ttl=PREDICTION_CACHE_TTL,
+    disk_dir=f"{CACHE_DIR}/predictions",
+    disk_max_bytes=PREDICTION_CACHE_DISK_MAX_BYTES,
+)
+
+
+class APIError(Exception):
+    """Raised when the segmentation backend answers with a non-200 status."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"API error ({status_code}): {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+def image_digest(image):
+    """Content hash of the decoded pixels (independent of the file encoding)."""
+    h = hashlib.sha256()
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def prediction_key(digest, endpoint):
+    return make_key(digest, endpoint, MASK_FORMAT)
+
+
+def _predict(image, endpoint, digest=None, payload=None, original=None):
+    """Cached mask bytes, plus the Payload sent (None on a cache hit)."""
+    with metrics.stage("cache"):
+        key = prediction_key(digest or image_digest(image), endpoint)
+        content = PREDICTION_CACHE.get(key)
+    if content is not None:
+        return content, None
+
+    if payload is None:
+        with metrics.stage("encode"):
+            payload = encode_image(image, original)
+    files = {"file": (payload.filename, payload.data, payload.mime)}
+    # The backend is a pure function of the image: safe to retry
+    with metrics.stage("post"):
+        response = http_client.post(
+            endpoint, files=files, params={"mask_format": MASK_FORMAT},
+            timeout=endpoint_timeout(endpoint), idempotent=True,
+        )
+    if response.status_code != 200:
+        raise APIError(response.status_code, response.text)
+    PREDICTION_CACHE.set(key, response.content)
+    return response.content, payload
+
+
+def predict(image, endpoint, digest=None, payload=None, original=None):
+    """Raw mask bytes predicted for ``image`` by ``endpoint``.
+
+    Results are cached on the image content hash + endpoint, so encoding
+    and the round trip to Cloud Run only happen on a miss. ``original`` is
+    the file the image was decoded from, uploaded as-is when possible.
+    ``digest`` / ``payload`` let callers hashing or encoding the image
+    themselves (e.g. to hit several endpoints) skip doing it again here.
+    """
+    return _predict(image, endpoint, digest, payload, original)[0]
+
+
+def segment(image, endpoint, digest=None, payload=None, original=None, class_data=FLAIR_CLASS_DATA):
+    """Return the predicted label image for ``image`` from ``endpoint``.
+
+    Compact class-index answers are colorized locally with ``class_data``
+    (the class map of the model behind ``endpoint``); colorized RGB answers
+    are returned as they are. ``label.info["upload"]`` describes what was
+    sent (encoder, size, encoding time), or is None for a cached answer.
+    """
+    content, sent = _predict(image, endpoint, digest, payload, original)
+    with metrics.stage("decode"):
+        label = None
+        if not content.startswith(RLE_MAGIC):
+            label = Image.open(BytesIO(content))
+            if label.mode in INDEX_MODES:
+                label = None
+        if label is None:
+            label = Image.fromarray(colorize(decode_mask(content, class_data), class_data))
+    label.info["upload"] = sent and {
+        "encoder": sent.encoder, "bytes": len(sent.data), "seconds": sent.seconds,
+    }
+    return label
+
+
+def segment_mask(image, endpoint, class_data, digest=None, payload=None, original=None):
+    """Return the predicted (H, W) uint8 class-index array for ``image``."""
+    return decode_mask(predict(image, endpoint, digest, payload, original), class_data)
+
+
+def _timed_segment(image, endpoint, digest=None, payload=None, class_data=FLAIR_CLASS_DATA):
+    start = time.perf_counter()
+    label = segment(image, endpoint, digest=digest, payload=payload, class_data=class_data)
+    return label, time.perf_counter() - start
+
+
+def _completed(futures):
+    """Yield ``(key, label_image, seconds, error)`` as the futures finish."""
+    for future in as_completed(futures):
+        key = futures[future]
+        try:
+            label, seconds = future.result()
+        except (APIError, http_client.RequestException) as e:
+            yield key, None, None, e
+        else:
+            yield key, label, seconds, None
+
+
+def segment_models(image, endpoints, max_workers=None, class_data=FLAIR_CLASS_DATA, original=None):
+    """Run ``image`` through several models at once.
+
+    ``endpoints`` maps a model name to its endpoint, or to an
+    ``(endpoint, class_data)`` pair for models not using ``class_data``.
+    The image is hashed and
+    encoded a single time (``original`` bytes are sent as-is when possible),
+    and the calls run concurrently. Yields
+    ``(name, label_image, seconds, error)`` in completion order, so results
+    can be shown as soon as each model answers.
+    """
+    models = {
+        name: target if isinstance(target, tuple) else (target, class_data)
+        for name, target in endpoints.items()
+    }
+    digest = image_digest(image)
+    misses = [
+        endpoint for endpoint, _ in models.values()
+        if prediction_key(digest, endpoint) not in PREDICTION_CACHE
+    ]
+    payload = encode_image(image, original) if misses else None
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(models)) as pool:
+        futures = {
+            pool.submit(metrics.bind(_timed_segment), image, endpoint, digest, payload, model_classes): name
+            for name, (endpoint, model_classes) in models.items()
+        }
+        yield from _completed(futures)
+
+
+def segment_images(images, endpoint, max_workers=SERIES_WORKERS, class_data=FLAIR_CLASS_DATA):
+    """Run several images (e.g. the dates of a time series) through one model.
+
+    At most ``max_workers`` requests are in flight. Every image is cached on
+    its own, so adding a date to a series only costs one new call. Yields
+    ``(index, label_image, seconds, error)`` in completion order.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(metrics.bind(_timed_segment), image, endpoint, class_data=class_data): i
+            for i, image in enumerate(images)
+        }
+        yield from _completed(futures)
@@ -0,0 +1,120 @@
+# utils/tiling.py
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from PIL import Image
+
+from utils.constants import TILE_SIZE, TILE_WORKERS, FLAIR_CLASS_DATA
+from utils import metrics
+from utils.segmentation import segment
+
+
+def axis_offsets(length, tile_size, overlap=0):
+    """Tile start offsets along one axis.
+
+    Tiles advance by ``tile_size - overlap``; the last one is pulled back to
+    end exactly on the image edge so no tile hangs over (unless the image is
+    smaller than a tile, in which case the single tile gets padded).
+    """
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError("overlap must be smaller than tile_size")
+    if length <= tile_size:
+        return [0]
+    offsets = list(range(0, length - tile_size, stride))
+    offsets.append(length - tile_size)
+    return offsets
+
+
+def _keep_bounds(offsets, tile_size, length):
+    """Part of each tile written to the mosaic: overlaps are split in the middle."""
+    bounds = []
+    for i, start in enumerate(offsets):
+        lo = 0 if i == 0 else (start + min(offsets[i - 1] + tile_size, length)) // 2
+        hi = length if i == len(offsets) - 1 else (offsets[i + 1] + min(start + tile_size, length)) // 2
+        bounds.append((lo, hi))
+    return bounds
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE, overlap=0):
+    """List of ``(box, keep)`` pairs covering a ``width`` x ``height`` image.
+
+    ``box`` is the (left, top, right, bottom) crop sent to the model and
+    ``keep`` the (left, top, right, bottom) area of the mosaic it fills.
+    """
+    xs = axis_offsets(width, tile_size, overlap)
+    ys = axis_offsets(height, tile_size, overlap)
+    x_keep = _keep_bounds(xs, tile_size, width)
+    y_keep = _keep_bounds(ys, tile_size, height)
+    return [
+        ((x, y, x + tile_size, y + tile_size), (kx0, ky0, kx1, ky1))
+        for y, (ky0, ky1) in zip(ys, y_keep)
+        for x, (kx0, kx1) in zip(xs, x_keep)
+    ]
+
+
+def paste_tile(mosaic, label, box, keep):
+    """Write the ``keep`` area of a predicted tile into the ``mosaic`` array."""
+    left, top, right, bottom = box
+    size = (right - left, bottom - top)
+    if label.size != size:
+        # Model answered at another resolution: labels must not be interpolated
+        label = label.resize(size, Image.NEAREST)
+    tile = np.asarray(label.convert("RGB"))
+    kx0, ky0, kx1, ky1 = keep
+    mosaic[ky0:ky1, kx0:kx1] = tile[ky0 - top:ky1 - top, kx0 - left:kx1 - left]
+
+
+def iter_tiles(image, tile_size=TILE_SIZE, overlap=0):
+    """Lazily yield ``(box, keep, tile)``: each crop is read only when needed.
+
+    ``image`` is a PIL image or anything with ``size`` and ``crop(box)``,
+    e.g. a windowed raster reader (utils.raster). ``crop`` pads with black
+    where a box goes past the image.
+    """
+    width, height = image.size
+    for box, keep in tile_grid(width, height, tile_size, overlap):
+        yield box, keep, image.crop(box)
+
+
+def segment_tiled(image, endpoint, tile_size=TILE_SIZE, overlap=0,
+                  max_workers=TILE_WORKERS, progress=None, class_data=FLAIR_CLASS_DATA,
+                  out=None):
+    """Segment a large image tile by tile and stitch the full-resolution mask.
+
+    Tiles are sent concurrently through a pool of ``max_workers`` threads
+    (each tile goes through the prediction cache); at most twice that many
+    tiles are read ahead, so huge rasters stream through bounded memory.
+    ``progress(done, total)`` is called from the calling thread after every
+    finished tile. The mask is written into ``out`` (e.g. a disk-backed
+    ``np.memmap``) and returned as-is when given, else returned as an image.
+    """
+    width, height = image.size
+    total = len(tile_grid(width, height, tile_size, overlap))
+    mosaic = np.zeros((height, width, 3), dtype=np.uint8) if out is None else out
+    done = 0
+
+    def collect(finished):
+        nonlocal done
+        for future in finished:
+            box, keep = pending.pop(future)
+            paste_tile(mosaic, future.result(), box, keep)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            for box, keep, tile in iter_tiles(image, tile_size, overlap):
+                pending[pool.submit(metrics.bind(segment), tile, endpoint, class_data=class_data)] = (box, keep)
+                if len(pending) >= 2 * max_workers:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            while pending:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    return mosaic if out is not None else Image.fromarray(mosaic)
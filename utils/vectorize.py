@@ -0,0 +1,205 @@
+# utils/vectorize.py
+import numpy as np
+
+# Ring coordinates are pixel corners: x to the right, y *up* from the bottom
+# edge of the mask, so rings come out counter-clockwise (outer) / clockwise
+# (holes) as GeoJSON wants them once mapped to projected coordinates.
+# Everything is array work: no Python loop runs per pixel, segment or ring.
+
+
+def _runs(lines):
+    """``(line, start, stop, value)`` of the runs of equal non-zero values of each row."""
+    rows, width = lines.shape
+    padded = np.zeros((rows, width + 1), dtype=np.int8)   # zero column: runs never wrap
+    padded[:, :width] = lines
+    flat = padded.ravel()
+    starts = np.flatnonzero(np.diff(flat, prepend=np.int8(0)))
+    stops = np.append(starts[1:], flat.size)
+    values = flat[starts]
+    keep = values != 0
+    starts, stops, values = starts[keep], stops[keep], values[keep]
+    line = starts // (width + 1)
+    return line, starts - line * (width + 1), stops - line * (width + 1), values
+
+
+def _segments(padded):
+    """Boundary segments of the True pixels of a zero-bordered mask, region on their left.
+
+    Returns ``(x0, y0, x1, y1)``, horizontal segments first, and the
+    vertical runs ``(column, top row, bottom row, region east)``. Edges of
+    the same direction along a row / column are merged into one segment
+    (run-length), so every segment end is a corner of the outline.
+    """
+    height = padded.shape[0] - 2
+
+    # Horizontal edges: +1 where the region is below the line (walk west), -1 above (walk east)
+    line, start, stop, value = _runs(padded[1:, 1:-1] - padded[:-1, 1:-1])
+    y = height - line
+    west = value > 0
+    hx0, hx1 = np.where(west, stop, start), np.where(west, start, stop)
+
+    # Vertical edges: +1 where the region is east of the line (walk south), -1 west (walk north)
+    column, top, bottom, value = _runs((padded[1:-1, 1:] - padded[1:-1, :-1]).T)
+    south = value > 0
+    vy0 = np.where(south, height - top, height - bottom)
+    vy1 = np.where(south, height - bottom, height - top)
+
+    segments = (
+        np.concatenate([hx0, column]),
+        np.concatenate([y, vy0]),
+        np.concatenate([hx1, column]),
+        np.concatenate([y, vy1]),
+    )
+    return segments, (column, top, bottom, south)
+
+
+def _successors(x0, y0, x1, y1, stride):
+    """Next segment of every segment along its ring.
+
+    Where two segments start at the same corner (diagonal pixels) the left
+    turn is taken, keeping the region 4-connected.
+    """
+    starts = x0 * stride + y0
+    order = np.argsort(starts, kind="stable")
+    ends = x1 * stride + y1
+    first = np.searchsorted(starts[order], ends)
+    following = order[first]
+    saddle = np.flatnonzero(np.bincount(starts)[ends] == 2)
+    if saddle.size:
+        left_x, left_y = -np.sign(y1 - y0)[saddle], np.sign(x1 - x0)[saddle]
+        candidate = following[saddle]
+        turns_left = (
+            (np.sign(x1[candidate] - x0[candidate]) == left_x)
+            & (np.sign(y1[candidate] - y0[candidate]) == left_y)
+        )
+        following[saddle] = np.where(turns_left, candidate, order[first[saddle] + 1])
+    return following
+
+
+def _cycles(following):
+    """Ring of every segment (its smallest segment index) and its rank along the ring.
+
+    Pointer jumping: ``log2`` of the longest ring in array passes.
+    """
+    n = following.size
+    root = np.arange(n)
+    jump = following
+    while True:
+        merged = np.minimum(root, root[jump])
+        if np.array_equal(merged, root):
+            break
+        root, jump = merged, jump[jump]
+
+    # Distance to the segment closing each ring (list ranking), root first
+    last = following == root
+    distance = (~last).astype(np.int64)
+    jump = np.where(last, np.arange(n), following)
+    while True:
+        further = jump[jump]
+        if np.array_equal(further, jump):
+            break
+        distance = distance + distance[jump]
+        jump = further
+    return root, distance
+
+
+def _hole_owners(padded, segments, vertical, ring, area):
+    """Ring number of the outer ring around every ring (itself for outer rings).
+
+    Just left of a hole's leftmost edge is a pixel of the polygon; the row
+    run holding that pixel starts on another ring of the same polygon,
+    further left. Following those steps ends on the outer ring.
+    """
+    height, width = padded.shape[0] - 2, padded.shape[1] - 2
+    x0, y0, _, y1 = segments
+    column, top, _, south = vertical
+    offset = x0.size - column.size   # vertical segments come after the horizontal ones
+    owner = np.arange(area.size)
+    holes = area < 0
+    if not holes.any():
+        return owner
+
+    # Leftmost vertical segment of every ring
+    order = np.lexsort((column, ring[offset:]))
+    rings, firsts = np.unique(ring[offset:][order], return_index=True)
+    leftmost = order[firsts]
+    is_hole = holes[rings]
+    rings, leftmost = rings[is_hole], leftmost[is_hole]
+    row = height - np.maximum(y0, y1)[offset + leftmost]   # top pixel row along the edge
+    col = column[leftmost] - 1                              # polygon pixel left of it
+
+    # Start of the row run holding that pixel
+    run_starts = np.flatnonzero((padded[1:-1, 1:] - padded[1:-1, :-1]).ravel() == 1)
+    found = run_starts[np.searchsorted(run_starts, row * (width + 1) + col, side="right") - 1]
+    run_left = found - row * (width + 1)
+
+    # The region-east vertical segment covering that row at that column
+    east = np.flatnonzero(south)
+    keys = column[east] * (height + 1) + top[east]
+    by_key = np.argsort(keys)
+    hit = np.searchsorted(keys[by_key], run_left * (height + 1) + row, side="right") - 1
+    owner[rings] = ring[offset + east[by_key[hit]]]
+
+    while True:
+        jumped = owner[owner]
+        if np.array_equal(jumped, owner):
+            return owner
+        owner = jumped
+
+
+def trace(mask, min_pixels=0):
+    """Polygons of the True pixels of ``mask`` as flat arrays ``(points, offsets, owners)``.
+
+    ``points`` holds the closed rings one after the other, ring ``i`` being
+    ``points[offsets[i]:offsets[i + 1]]``; ``owners[i]`` numbers the polygon
+    of ring ``i``, whose outer ring comes first, then its holes. Diagonal
+    neighbours are separate polygons (4-connectivity). Polygons smaller
+    than ``min_pixels`` pixels are dropped and holes that small are filled.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+    padded = np.zeros((height + 2, width + 2), dtype=np.int8)
+    padded[1:-1, 1:-1] = mask
+    segments, vertical = _segments(padded)
+    x0, y0, x1, y1 = segments
+    if not x0.size:
+        return np.empty((0, 2)), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    root, distance = _cycles(_successors(x0, y0, x1, y1, height + 2))
+    roots = np.flatnonzero(root == np.arange(root.size))
+    ring = np.searchsorted(roots, root)
+    area = np.bincount(ring, weights=(x0 * y1 - x1 * y0).astype(np.float64)) / 2   # shoelace
+    owner = _hole_owners(padded, segments, vertical, ring, area)
+
+    smallest = max(min_pixels, 1)
+    kept = (np.abs(area) >= smallest) & (area[owner] >= smallest)
+    kept_rings = np.flatnonzero(kept)
+    kept_rings = kept_rings[np.lexsort((area[kept_rings] < 0, owner[kept_rings]))]
+
+    # Segments of the kept rings, ring after ring, each from its root
+    segment_order = np.lexsort((-distance, ring))
+    ring_start = np.searchsorted(ring[segment_order], kept_rings)
+    lengths = np.bincount(ring, minlength=area.size)[kept_rings]
+    offsets = np.concatenate([[0], np.cumsum(lengths + 1)])
+    which = np.repeat(np.arange(kept_rings.size), lengths + 1)
+    step = np.arange(offsets[-1]) - offsets[which]
+    chosen = segment_order[ring_start[which] + step % lengths[which]]   # first corner repeated
+    points = np.column_stack([x0[chosen], y0[chosen]]).astype(np.float64)
+    return points, offsets, owner[kept_rings]
+
+
+def ring_area(ring):
+    """Signed area (shoelace): positive for counter-clockwise rings."""
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def polygons(mask, min_pixels=0):
+    """Polygons of the True pixels of ``mask``: lists ``[outer, *holes]`` of rings (see ``trace``)."""
+    points, offsets, owners = trace(mask, min_pixels)
+    result = []
+    for i, owner in enumerate(owners.tolist()):
+        if not i or owner != owners[i - 1]:
+            result.append([])
+        result[-1].append(points[offsets[i]:offsets[i + 1]])
+    return result